@@ -1,156 +1,482 @@
+import os
 import pygame
 import sys
-from scripts.entities import PhysicsEntity, Player
-from scripts.utils import load_image, load_images, load_transparent_images, Animation
+import argparse
+from scripts.entities import PhysicsEntity, Player, ENTITY_CELL_SIZE
+from scripts.utils import use_atlas, use_loader
+from scripts.atlas import Atlas
+from scripts.assets import (
+    AssetLoader,
+    AssetRegistry,
+    image,
+    images,
+    animation,
+)
 from scripts.tilemap import TileMap
+from scripts.spatial import SpatialHash
+from scripts.entity_manager import EntityManager
+from scripts.streaming import ChunkStreamer
 from scripts.clouds import Clouds
-from scripts.particle import Particle
+from scripts.particle import ParticleSystem
+from scripts.profiler import Profiler, ProfilerOverlay
+from scripts.replay import InputRecorder, Replay, ReplayDriver
+from scripts.renderer import (
+    RenderQueue,
+    Presenter,
+    SCALE_MODES,
+    SCALE_NEAREST,
+    LAYER_BACKGROUND,
+    LAYER_CLOUDS,
+    LAYER_TILES,
+    LAYER_ENTITIES,
+    LAYER_PARTICLES,
+)
 import random
-import math
+
+# Player actions triggered by each key.
+KEY_ACTIONS = {
+    pygame.K_a: "left",
+    pygame.K_LEFT: "left",
+    pygame.K_d: "right",
+    pygame.K_RIGHT: "right",
+    pygame.K_SPACE: "jump",
+    pygame.K_UP: "jump",
+    pygame.K_w: "jump",
+    pygame.K_f: "dash",
+}
+
+# Every asset group, loaded on first use by the AssetRegistry.
+ASSET_GROUPS = {
+    "decor": images("tiles/decor", transparent=True),
+    "grass": images("tiles/grass"),
+    "large_decor": images("tiles/large_decor"),
+    "stone": images("tiles/stone"),
+    "spawners": images("tiles/spawners"),
+    "background": image("background.png"),
+    "clouds": images("clouds"),
+    "player_stand": image("entities/player.png"),
+    "player": {
+        "idle": animation("entities/player/idle", image_duration=6, transparent=True),
+        "jump": animation("entities/player/jump"),
+        "run": animation("entities/player/run", image_duration=4),
+        "slide": animation("entities/player/slide"),
+        "wall_jump": animation("entities/player/wall_jump"),
+    },
+    "enemy": {
+        "idle": animation("entities/enemy/idle", image_duration=6),
+        "run": animation("entities/enemy/run", image_duration=4),
+    },
+    "particle/leaf": animation("particles/leaf", image_duration=20, loop=False),
+    "particle/particle": animation("particles/particle", image_duration=6, loop=False),
+}
+# Asset groups every level draws on its first frame. The tile sets of a particular level are preloaded
+# while its map loads, and its other groups once it has, see `Game.level_assets`.
+LEVEL_ASSETS = ["background", "clouds", "player", "particle/particle"]
 
 
 class Game:
-    def __init__(self):
+    def __init__(
+        self,
+        headless=False,
+        map_path="map.json",
+        seed=None,
+        render_size=None,
+        scaling=SCALE_NEAREST,
+        stream_radius=None,
+    ):
         """
         This function initializes various attributes and objects for a game.
+
+        :param headless: The `headless` parameter runs the game without a window, using SDL's dummy
+        video driver. Frames are still rendered and scaled, into an off-screen surface, defaults to
+        False (optional)
+        :param map_path: The `map_path` parameter is the map file to load, defaults to "map.json"
+        (optional)
+        :param seed: The `seed` parameter seeds the game's random number generator, which drives the
+        clouds, leaves and dash particles. A random seed is picked when it is None, defaults to None
+        (optional)
+        :param render_size: The `render_size` parameter is the (width, height) frames are rendered at
+        before they are scaled to the window, defaults to half the window size (optional)
+        :param scaling: The `scaling` parameter is how frames are scaled to the window, one of
+        `scripts.renderer.SCALE_MODES`, defaults to SCALE_NEAREST (optional)
+        :param stream_radius: The `stream_radius` parameter streams a binary map instead of loading it
+        whole, keeping only the chunks within this many chunks of the camera loaded, defaults to None
+        (optional)
         """
+        self.headless = headless
+        self.map_path = map_path
+        self.stream_radius = stream_radius
+        self.seed = random.randrange(2**32) if seed is None else seed
+        self.rng = random.Random(self.seed)
+        self.tick = 0
+        self.recorder = None
+        if headless:
+            os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
         pygame.init()
 
         self.WIDTH, self.HEIGHT = 1920, 1010
         self.FPS = 60
+        self.TICK_RATE = 60
+        self.MAX_CATCH_UP_STEPS = 5
+        self.interpolate = True
 
         pygame.display.set_caption("Game Master")
 
-        self.screen = pygame.display.set_mode((self.WIDTH, self.HEIGHT))
-        self.display = pygame.Surface((self.WIDTH / 2, self.HEIGHT / 2))
+        self.presenter = Presenter(
+            (self.WIDTH, self.HEIGHT),
+            render_size or (self.WIDTH / 2, self.HEIGHT / 2),
+            scaling=scaling,
+            headless=headless,
+        )
+        self.screen = self.presenter.screen
+        self.display = self.presenter.display
+
+        self.loader = AssetLoader()
+        atlas = Atlas.load(loader=self.loader)
+        use_atlas(atlas)
+        use_loader(self.loader)
+        self.profiler = Profiler()
+        self.overlay = None
+        self.profile_path = None
+        self.render_queue = RenderQueue(self.display.get_size(), profiler=self.profiler)
 
         self.clock = pygame.time.Clock()
 
         self.movement = [False, False]
 
-        self.assets = {
-            "decor": load_transparent_images("tiles/decor"),
-            "grass": load_images("tiles/grass"),
-            "large_decor": load_images("tiles/large_decor"),
-            "stone": load_images("tiles/stone"),
-            "background": load_image("background.png"),
-            "clouds": load_images("clouds"),
-            "player_stand": load_image("entities/player.png"),
-            "player": {
-                "idle": Animation(
-                    load_transparent_images("entities/player/idle"), image_duration=6
-                ),
-                "jump": Animation(load_images("entities/player/jump")),
-                "run": Animation(load_images("entities/player/run"), image_duration=4),
-                "slide": Animation(load_images("entities/player/slide")),
-                "wall_jump": Animation(load_images("entities/player/wall_jump")),
-            },
-            "particle/leaf": Animation(
-                load_images("particles/leaf"), image_duration=20, loop=False
-            ),
-            "particle/particle": Animation(
-                load_images("particles/particle"), image_duration=6, loop=False
-            ),
-        }
+        self.assets = AssetRegistry(
+            ASSET_GROUPS,
+            loader=self.loader,
+            exclude=atlas if atlas is not None else (),
+        )
+        self.assets.preload(LEVEL_ASSETS)
 
-        self.clouds = Clouds(self.assets["clouds"], count=16)
+        self.clouds = Clouds(self.assets["clouds"], count=16, rng=self.rng)
 
+        self.entity_hash = SpatialHash(cell_size=ENTITY_CELL_SIZE)
         self.player = Player(self, (50, 50), (16, 30))
 
-        self.tilemap = TileMap(self, tile_size=32)
+        # The map's tile sets are preloaded as soon as the map's type table is read. Its offgrid
+        # tiles would otherwise load them one at a time.
+        self.tilemap = TileMap(self, tile_size=32, preload=self.assets.preload)
 
-        self.tilemap.load("map.json")
+        self.streamer = None
+        if stream_radius is None:
+            self.tilemap.load(map_path)
+            trees = self.tilemap.extract([("large_decor", 2)], keep=True)
+        else:
+            self.streamer = ChunkStreamer(self.tilemap, map_path, radius=stream_radius)
+            trees = self.streamer.extract([("large_decor", 2)], keep=True)
+
+        self.entities = EntityManager(self)
+        self.entities.spawn_from_map(
+            self.tilemap if self.streamer is None else self.streamer
+        )
 
         self.leaf_spawners = []
         self.leaf_spawners.extend(
             pygame.Rect(4 + tree["pos"][0], 4 + tree["pos"][1], 23, 13)
-            for tree in self.tilemap.extract([("large_decor", 2)], keep=True)
+            for tree in trees
         )
+        self.assets.preload(self.level_assets())
+        self.loader.save_cache()
 
-        self.particles = []
+        self.particles = ParticleSystem(self)
 
         self.scroll = [0, 0]
+        self.prev_scroll = [0, 0]
+        if self.streamer is not None:
+            self.update_streaming()
 
-    def run(self):
+    def level_assets(self) -> list:
         """
-        The `run` function is responsible for running the game loop, updating the display, handling
-        player input, and rendering game objects.
+        The `level_assets` function lists the asset groups the loaded level needs on top of
+        LEVEL_ASSETS: its tile sets, its enemies and the leaves falling from its trees.
+
+        :return: a list of group names.
         """
-        while True:
-            self.display.fill((22, 39, 112))
-            self.display.blit(self.assets["background"], (0, 0))
-
-            self.scroll[0] += (
-                self.player.rect().centerx
-                - self.display.get_width() / 2
-                - self.scroll[0]
-            ) / 30
-            self.scroll[1] += (
-                self.player.rect().centery
-                - ((self.display.get_height() / 2) + (self.display.get_height() / 8))
-                - self.scroll[1]
-            ) / 30
-            render_scroll = (int(self.scroll[0]), int(self.scroll[1]))
-
-            for rect in self.leaf_spawners:
-                if random.random() * 49999 < rect.width * rect.height:
-                    pos = (
-                        rect.x + random.random() * rect.width,
-                        rect.y + random.random() * rect.height,
-                    )
-                    self.particles.append(
-                        Particle(
-                            self,
-                            "leaf",
-                            pos,
-                            velocity=[-0.1, 0.3],
-                            frame=random.randint(0, 20),
-                        )
-                    )
+        names = list(self.tilemap.tile_types)
+        names.extend(tile_type for tile_type, _ in self.tilemap.offgrid_groups)
+        if len(self.entities):
+            names.append("enemy")
+        if self.leaf_spawners:
+            names.append("particle/leaf")
+        return names
 
-            self.clouds.update()
-            self.clouds.render(self.display, offset=render_scroll)
+    def update_streaming(self):
+        """
+        The `update_streaming` function moves the streamed part of the map along with the camera and
+        makes sure the chunks around the player are loaded.
+        """
+        self.streamer.update(
+            (
+                self.scroll[0] + self.display.get_width() / 2,
+                self.scroll[1] + self.display.get_height() / 2,
+            ),
+            focus=self.player.bounds().center,
+        )
+
+    def handle_events(self):
+        """
+        The `handle_events` function processes pending window and keyboard events, updating the held
+        movement keys and triggering jumps and dashes.
+        """
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                self.quit()
+
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.toggle_overlay()
+            if event.type == pygame.KEYDOWN and event.key in KEY_ACTIONS:
+                self.apply_input(KEY_ACTIONS[event.key], True)
+            if event.type == pygame.KEYUP and event.key in KEY_ACTIONS:
+                self.apply_input(KEY_ACTIONS[event.key], False)
+
+    def toggle_overlay(self):
+        """
+        The `toggle_overlay` function shows or hides the profiling overlay, turning the profiler on and
+        off with it.
+        """
+        if self.overlay is None:
+            self.profiler.enabled = True
+            self.overlay = ProfilerOverlay(self.profiler)
+        else:
+            self.profiler.enabled = self.profile_path is not None
+            self.overlay = None
+
+    def quit(self):
+        """
+        The `quit` function saves the input recording, if one is running, exports the profiler's
+        statistics if `profile_path` is set, stops the background loaders and exits the game.
+        """
+        if self.recorder is not None:
+            self.recorder.save()
+        if self.profile_path is not None:
+            self.profiler.export(self.profile_path)
+        if self.streamer is not None:
+            self.streamer.close()
+        self.loader.save_cache()
+        self.loader.close()
+        pygame.quit()
+        sys.exit()
+
+    def apply_input(self, action, pressed):
+        """
+        The `apply_input` function applies one player action, whether it comes from the keyboard or from
+        a script.
+
+        :param action: The `action` parameter is one of "left", "right", "jump" or "dash"
+        :param pressed: The `pressed` parameter is True when the key goes down and False when it is
+        released. Jumps and dashes only react to presses
+        """
+        if self.recorder is not None:
+            self.recorder.record_input(self.tick, action, pressed)
+        if action == "left":
+            self.movement[0] = pressed
+        elif action == "right":
+            self.movement[1] = pressed
+        elif action == "jump" and pressed:
+            self.player.jump()
+        elif action == "dash" and pressed:
+            self.player.dash()
+
+    def step(self):
+        """
+        The `step` function advances the simulation by one fixed tick: the camera, the leaf spawners,
+        the clouds, the player and the particles.
+        """
+        self.prev_scroll = list(self.scroll)
+        self.scroll[0] += (
+            self.player.bounds().centerx - self.display.get_width() / 2 - self.scroll[0]
+        ) / 30
+        self.scroll[1] += (
+            self.player.bounds().centery
+            - ((self.display.get_height() / 2) + (self.display.get_height() / 8))
+            - self.scroll[1]
+        ) / 30
 
-            self.tilemap.render(self.display, offset=render_scroll)
+        if self.streamer is not None:
+            with self.profiler.scope("streaming.update"):
+                self.update_streaming()
 
+        for rect in self.leaf_spawners:
+            if self.rng.random() * 49999 < rect.width * rect.height:
+                pos = (
+                    rect.x + self.rng.random() * rect.width,
+                    rect.y + self.rng.random() * rect.height,
+                )
+                self.particles.spawn("leaf", pos, velocity=(-0.1, 0.3))
+
+        with self.profiler.scope("clouds.update"):
+            self.clouds.update()
+
+        with self.profiler.scope("player.update"):
             self.player.update(self.tilemap, (self.movement[1] - self.movement[0], 0))
-            self.player.render(self.display, offset=render_scroll)
-
-            for particle in self.particles.copy():
-                kill = particle.update()
-                particle.render(self.display, offset=render_scroll)
-                if particle.type == "leaf":
-                    particle.pos[0] += math.sin(particle.animation.frame * 0.035) * 0.3
-                if kill:
-                    self.particles.remove(particle)
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-
-                if event.type == pygame.KEYDOWN:
-                    if event.key in (pygame.K_a, pygame.K_LEFT):
-                        self.movement[0] = True
-                    if event.key in (pygame.K_d, pygame.K_RIGHT):
-                        self.movement[1] = True
-                    if event.key in (pygame.K_SPACE, pygame.K_UP, pygame.K_w):
-                        self.player.jump()
-                    if event.key == pygame.K_f:
-                        self.player.dash()
-                if event.type == pygame.KEYUP:
-                    if event.key in (pygame.K_a, pygame.K_LEFT):
-                        self.movement[0] = False
-                    if event.key in (pygame.K_d, pygame.K_RIGHT):
-                        self.movement[1] = False
-
-            self.screen.blit(
-                pygame.transform.scale(self.display, self.screen.get_size()), (0, 0)
+
+        with self.profiler.scope("entities.update"):
+            self.entities.update(self.camera())
+
+        with self.profiler.scope("particles.update"):
+            self.particles.update()
+
+        self.tick += 1
+        if self.recorder is not None:
+            self.recorder.record_tick()
+
+    def camera(self):
+        """
+        The `camera` function returns the part of the world the display shows.
+        :return: a pygame.Rect in world pixels.
+        """
+        return pygame.Rect(
+            int(self.scroll[0]), int(self.scroll[1]), *self.display.get_size()
+        )
+
+    def render(self, alpha=1.0):
+        """
+        The `render` function draws the current state of the game and presents it on the screen.
+
+        :param alpha: The `alpha` parameter is how far the current frame lies between the previous
+        simulation tick (0) and the latest one (1). The camera and the player are drawn at that point
+        between their two positions, defaults to 1.0 (optional)
+        """
+        self.display.fill((22, 39, 112))
+        self.render_queue.submit(self.assets["background"], (0, 0), LAYER_BACKGROUND)
+
+        render_scroll = (
+            int(self.prev_scroll[0] + (self.scroll[0] - self.prev_scroll[0]) * alpha),
+            int(self.prev_scroll[1] + (self.scroll[1] - self.prev_scroll[1]) * alpha),
+        )
+        view_size = self.render_queue.size
+
+        # Building each layer's draw list is timed under "<layer name>.submit", apart from the
+        # "<layer name>.draw" scopes the render queue times its blits under.
+        with self.profiler.scope("clouds.submit"):
+            self.render_queue.extend(
+                self.clouds.draw_list(view_size, offset=render_scroll), LAYER_CLOUDS
+            )
+        with self.profiler.scope("tiles.submit"):
+            self.render_queue.extend(
+                self.tilemap.draw_list(view_size, offset=render_scroll), LAYER_TILES
             )
+        with self.profiler.scope("entities.submit"):
+            self.render_queue.extend(
+                self.entities.draw_list(view_size, offset=render_scroll, alpha=alpha),
+                LAYER_ENTITIES,
+            )
+            self.render_queue.extend(
+                self.player.draw_list(view_size, offset=render_scroll, alpha=alpha),
+                LAYER_ENTITIES,
+            )
+        with self.profiler.scope("particles.submit"):
+            self.render_queue.extend_arrays(
+                *self.particles.draw_arrays(offset=render_scroll), LAYER_PARTICLES
+            )
+
+        self.render_queue.flush(self.display)
+        self.profiler.count("blits", sum(self.render_queue.draw_counts.values()))
+        self.profiler.count("culled", self.render_queue.total_culled)
+        self.profiler.count("particles", len(self.particles))
+        self.profiler.count("chunk_surfaces", len(self.tilemap.chunk_surfaces))
+        self.profiler.count("chunks", len(self.tilemap.chunks))
+        self.profiler.count("entities.active", self.entities.active)
+        self.profiler.count("entities.sleeping", self.entities.sleeping)
+        self.profiler.count("assets.bytes", self.assets.size)
+
+        with self.profiler.scope("present"):
+            self.presenter.present()
 
-            pygame.display.update()
-            self.clock.tick(self.FPS)
+        if self.overlay is not None:
+            self.overlay.render(self.screen)
+
+        self.presenter.flip()
+
+    def run(self):
+        """
+        The `run` function is responsible for running the game loop. The simulation advances in fixed
+        ticks of 1 / TICK_RATE seconds, however long each frame takes to render, with at most
+        MAX_CATCH_UP_STEPS ticks per frame; time beyond that is dropped so a long stall slows the game
+        down instead of freezing it. Frames are rendered at up to FPS frames per second (0 means
+        uncapped), interpolated between the last two ticks when `interpolate` is set.
+        """
+        tick_time = 1 / self.TICK_RATE
+        accumulator = 0.0
+        self.clock.tick()
+        while True:
+            accumulator += self.clock.tick(self.FPS) / 1000
+
+            self.handle_events()
+
+            steps = 0
+            with self.profiler.scope("step"):
+                while accumulator >= tick_time and steps < self.MAX_CATCH_UP_STEPS:
+                    self.step()
+                    accumulator -= tick_time
+                    steps += 1
+            if steps == self.MAX_CATCH_UP_STEPS:
+                accumulator = min(accumulator, tick_time)
+
+            with self.profiler.scope("render"):
+                self.render(accumulator / tick_time if self.interpolate else 1.0)
+            self.profiler.end_frame()
 
 
 if __name__ == "__main__":
-    Game().run()
+    parser = argparse.ArgumentParser(description="Game Master")
+    parser.add_argument("--map", default="map.json", help="map file to load")
+    parser.add_argument("--seed", type=int, help="random seed, random by default")
+    parser.add_argument(
+        "--scaling", choices=SCALE_MODES, default=SCALE_NEAREST, help="window scaling"
+    )
+    parser.add_argument(
+        "--render-size",
+        type=lambda size: tuple(int(n) for n in size.split("x")),
+        help="render resolution as WIDTHxHEIGHT, half the window size by default; a replay uses the "
+        "one it was recorded at",
+    )
+    parser.add_argument(
+        "--stream-radius",
+        type=int,
+        help="stream a binary .map around the camera, keeping this many chunks loaded; a replay "
+        "uses the radius it was recorded with",
+    )
+    parser.add_argument("--record", help="record inputs to this replay file")
+    parser.add_argument("--replay", help="play back this replay file")
+    parser.add_argument(
+        "--profile", action="store_true", help="start with the profiling overlay (F3)"
+    )
+    parser.add_argument(
+        "--profile-out", help="export profiler statistics to this .csv or .json file"
+    )
+    args = parser.parse_args()
+
+    if args.replay:
+        replay = Replay.load(args.replay)
+        game = Game(
+            map_path=replay.map_path,
+            seed=replay.seed,
+            render_size=replay.render_size,
+            scaling=args.scaling,
+            stream_radius=replay.stream_radius,
+        )
+        divergence = ReplayDriver(game, replay).run(render=True)
+        if divergence is not None:
+            print(f"replay diverged at tick {divergence}")
+        pygame.quit()
+    else:
+        game = Game(
+            map_path=args.map,
+            seed=args.seed,
+            render_size=args.render_size,
+            scaling=args.scaling,
+            stream_radius=args.stream_radius,
+        )
+        if args.record:
+            InputRecorder(game, args.record)
+        if args.profile_out:
+            game.profiler.enabled = True
+            game.profile_path = args.profile_out
+        if args.profile:
+            game.toggle_overlay()
+        game.run()
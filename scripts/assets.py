@@ -0,0 +1,475 @@
+import os
+import struct
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import pygame
+
+from scripts.utils import (
+    BASE_IMG_PATH,
+    load_image,
+    load_images,
+    load_transparent_image,
+    load_transparent_images,
+    Animation,
+)
+from scripts.atlas import unkeyed
+
+ASSET_CACHE_PATH = "data/cache/images.bin"
+CACHE_MAGIC = b"GMIC"
+CACHE_VERSION = 1
+# magic, version, entry count
+CACHE_HEADER_FORMAT = "<4sHI"
+# path length, source mtime in nanoseconds, source size in bytes, width, height; followed by the
+# path and width * height RGBA pixels
+CACHE_ENTRY_FORMAT = "<HqqII"
+LOADER_WORKERS = 4
+# Approximate bytes of pixels the registry keeps before evicting least recently used groups.
+ASSET_BUDGET = 64 * 1024 * 1024
+
+
+def load_unkeyed(path):
+    """
+    The function loads a PNG, turning it into a per-pixel alpha surface only if it is colour-keyed,
+    since the colour key is lost when the pixels are cached.
+
+    :param path: The `path` parameter is the image file to load
+    :return: an unconverted pygame.Surface that converts to the same pixels as the PNG would.
+    """
+    img = pygame.image.load(path)
+    if img.get_colorkey() is not None:
+        return unkeyed(img)
+    return img
+
+
+# The ImageCache class keeps the decoded RGBA pixels of images in a single file, so a warm start reads
+# one file instead of decoding every PNG. Entries are keyed by path and only served while the source
+# file's modification time and size still match.
+class ImageCache:
+    def __init__(self, path=ASSET_CACHE_PATH):
+        """
+        The function reads the cache file, if there is a valid one.
+
+        :param path: The `path` parameter is the cache file, defaults to ASSET_CACHE_PATH (optional)
+        """
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            magic, version, count = struct.unpack_from(CACHE_HEADER_FORMAT, data)
+        except (OSError, struct.error):
+            return
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            return
+
+        view = memoryview(data)
+        offset = struct.calcsize(CACHE_HEADER_FORMAT)
+        entry_size = struct.calcsize(CACHE_ENTRY_FORMAT)
+        for _ in range(count):
+            length, mtime, size, width, height = struct.unpack_from(
+                CACHE_ENTRY_FORMAT, data, offset
+            )
+            offset += entry_size
+            name = bytes(view[offset : offset + length]).decode("utf-8")
+            offset += length
+            pixels = view[offset : offset + 4 * width * height]
+            offset += 4 * width * height
+            self.entries[name] = (mtime, size, (width, height), pixels)
+
+    def get(self, path, stat):
+        """
+        The function returns the cached pixels of an image if they are still current.
+
+        :param path: The `path` parameter is the image file
+        :param stat: The `stat` parameter is the `os.stat` result of the image file
+        :return: an unconverted 32-bit RGBA pygame.Surface sharing the cache's memory, or None on a miss.
+        """
+        entry = self.entries.get(path)
+        if (
+            entry is None
+            or entry[0] != stat.st_mtime_ns
+            or entry[1] != stat.st_size
+            or len(entry[3]) != 4 * entry[2][0] * entry[2][1]
+        ):
+            return None
+        return pygame.image.frombuffer(entry[3], entry[2], "RGBA")
+
+    def put(self, path, stat, surf):
+        """
+        The function stores the pixels of a freshly decoded image.
+
+        :param path: The `path` parameter is the image file
+        :param stat: The `stat` parameter is the `os.stat` result of the image file before it was read
+        :param surf: The `surf` parameter is the decoded surface
+        """
+        self.entries[path] = (
+            stat.st_mtime_ns,
+            stat.st_size,
+            surf.get_size(),
+            pygame.image.tobytes(surf, "RGBA"),
+        )
+        self.dirty = True
+
+    def save(self):
+        """
+        The function rewrites the cache file if images were added since it was read. Failures to write
+        are ignored, since the cache can always be rebuilt.
+        """
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            partial = f"{self.path}.{os.getpid()}.tmp"
+            with open(partial, "wb") as f:
+                f.write(
+                    struct.pack(
+                        CACHE_HEADER_FORMAT,
+                        CACHE_MAGIC,
+                        CACHE_VERSION,
+                        len(self.entries),
+                    )
+                )
+                for name, (mtime, size, (width, height), pixels) in sorted(
+                    self.entries.items()
+                ):
+                    name = name.encode("utf-8")
+                    f.write(
+                        struct.pack(
+                            CACHE_ENTRY_FORMAT, len(name), mtime, size, width, height
+                        )
+                    )
+                    f.write(name)
+                    f.write(pixels)
+            os.replace(partial, self.path)
+            self.dirty = False
+        except OSError:
+            pass
+
+
+# The AssetLoader class decodes images on a thread pool ahead of the loaders in `scripts.utils`,
+# which only convert the decoded surfaces for the display on the main thread. Images held by the
+# cache are not decoded at all.
+class AssetLoader:
+    def __init__(self, workers=LOADER_WORKERS, cache_path=ASSET_CACHE_PATH):
+        """
+        The function initializes a loader with its own thread pool.
+
+        :param workers: The `workers` parameter is the number of decoding threads, defaults to
+        LOADER_WORKERS (optional)
+        :param cache_path: The `cache_path` parameter is the file decoded pixels are cached in, or None
+        to disable the cache, defaults to ASSET_CACHE_PATH (optional)
+        """
+        self.cache = ImageCache(cache_path) if cache_path is not None else None
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.pending = {}
+        self.dirs = {}
+
+    def preload(self, groups, exclude=()):
+        """
+        The function lists the given image directories in a single walk and starts loading every PNG
+        in them.
+
+        :param groups: The `groups` parameter is a list of directories relative to BASE_IMG_PATH,
+        searched recursively; "" walks every image
+        :param exclude: The `exclude` parameter is a container of image paths that are listed but not
+        loaded, typically the atlas, defaults to () (optional)
+        """
+        for group in groups:
+            for root, _, files in os.walk(os.path.join(BASE_IMG_PATH, group)):
+                folder = os.path.relpath(root, BASE_IMG_PATH).replace(os.sep, "/")
+                folder = "" if folder == "." else folder
+                names = sorted(name for name in files if name.endswith(".png"))
+                self.dirs[folder] = names
+                for name in names:
+                    path = f"{folder}/{name}" if folder else name
+                    if path not in exclude:
+                        self.request(path)
+
+    def decode(self, path) -> Future:
+        """
+        The function starts loading an image file, from the cache if it holds the file's current
+        pixels and on the thread pool otherwise.
+
+        :param path: The `path` parameter is the image file, including files outside BASE_IMG_PATH
+        such as atlas pages
+        :return: a Future of an unconverted pygame.Surface, see `load_unkeyed`.
+        """
+        if self.cache is None:
+            return self.pool.submit(load_unkeyed, path)
+        stat = os.stat(path)
+        surf = self.cache.get(path, stat)
+        if surf is None:
+            return self.pool.submit(self.decode_into_cache, path, stat)
+        future = Future()
+        future.set_result(surf)
+        return future
+
+    def decode_into_cache(self, path, stat):
+        """
+        The function runs on the thread pool, decoding an image missing from the cache and adding it.
+
+        :param path: The `path` parameter is the image file
+        :param stat: The `stat` parameter is the `os.stat` result of the image file
+        :return: an unconverted pygame.Surface, see `load_unkeyed`.
+        """
+        surf = load_unkeyed(path)
+        self.cache.put(path, stat, surf)
+        return surf
+
+    def request(self, path):
+        """
+        The function starts loading one image, unless it is already on its way.
+
+        :param path: The `path` parameter is an image path relative to BASE_IMG_PATH
+        """
+        if path not in self.pending:
+            self.pending[path] = self.decode(BASE_IMG_PATH + path)
+
+    def listdir(self, path) -> list:
+        """
+        The function lists the images of a directory walked by `preload`.
+
+        :param path: The `path` parameter is a directory relative to BASE_IMG_PATH
+        :return: a sorted list of file names, or None if the directory was not walked.
+        """
+        return self.dirs.get(path)
+
+    def surface(self, path):
+        """
+        The function waits for an image to be loaded, requesting it first if needed. Each image is
+        handed out once; its surface is then dropped from the loader.
+
+        :param path: The `path` parameter is an image path relative to BASE_IMG_PATH
+        :return: an unconverted pygame.Surface, see `load_unkeyed`.
+        """
+        self.request(path)
+        return self.pending.pop(path).result()
+
+    def save_cache(self):
+        """
+        The function waits for the images still being decoded and writes every decoded image to the
+        cache.
+        """
+        for future in list(self.pending.values()):
+            future.exception()
+        if self.cache is not None:
+            self.cache.save()
+
+    def close(self):
+        """
+        The function stops the decoding threads, discarding the images that were never asked for.
+        """
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.pending.clear()
+
+
+# The AssetSpec class describes one asset, the images it is built from and how to build it, without
+# loading anything. Use the `image`, `images` and `animation` helpers below to make one.
+class AssetSpec:
+    def __init__(self, paths, build):
+        """
+        The function initializes a spec.
+
+        :param paths: The `paths` parameter is a list of the image files and directories the asset
+        reads, relative to BASE_IMG_PATH
+        :param build: The `build` parameter is a function without arguments returning the asset
+        """
+        self.paths = paths
+        self.build = build
+
+
+def image(path, transparent=False) -> AssetSpec:
+    """
+    The function describes a single image.
+
+    :param path: The `path` parameter is an image path relative to BASE_IMG_PATH
+    :param transparent: The `transparent` parameter loads it with per-pixel alpha instead of a black
+    colour key, defaults to False (optional)
+    :return: an AssetSpec.
+    """
+    load = load_transparent_image if transparent else load_image
+    return AssetSpec([path], lambda: load(path))
+
+
+def images(path, transparent=False) -> AssetSpec:
+    """
+    The function describes the list of images in a directory.
+
+    :param path: The `path` parameter is a directory relative to BASE_IMG_PATH
+    :param transparent: The `transparent` parameter loads them with per-pixel alpha instead of a black
+    colour key, defaults to False (optional)
+    :return: an AssetSpec.
+    """
+    load = load_transparent_images if transparent else load_images
+    return AssetSpec([path], lambda: load(path))
+
+
+def animation(path, image_duration=5, loop=True, transparent=False) -> AssetSpec:
+    """
+    The function describes an Animation of the images in a directory.
+
+    :param path: The `path` parameter is a directory relative to BASE_IMG_PATH
+    :param image_duration: The `image_duration` parameter is passed to Animation, defaults to 5
+    (optional)
+    :param loop: The `loop` parameter is passed to Animation, defaults to True (optional)
+    :param transparent: The `transparent` parameter loads the frames with per-pixel alpha instead of a
+    black colour key, defaults to False (optional)
+    :return: an AssetSpec.
+    """
+    load = load_transparent_images if transparent else load_images
+    return AssetSpec([path], lambda: Animation(load(path), image_duration, loop))
+
+
+def asset_bytes(asset) -> int:
+    """
+    The function estimates the pixel memory of an asset.
+
+    :param asset: The `asset` parameter is a surface, an Animation, or a list or dictionary of them
+    :return: the number of bytes. Views into atlas pages count as if they were separate surfaces.
+    """
+    if isinstance(asset, pygame.Surface):
+        return asset.get_width() * asset.get_height() * asset.get_bytesize()
+    if isinstance(asset, Animation):
+        return asset_bytes(asset.images)
+    if isinstance(asset, dict):
+        return sum(asset_bytes(value) for value in asset.values())
+    return sum(asset_bytes(value) for value in asset)
+
+
+# The AssetRegistry class resolves asset groups on first use instead of loading every group at
+# startup, and evicts the least recently used groups once their pixels exceed a memory budget.
+# Groups preloaded for the current level are pinned and never evicted.
+class AssetRegistry:
+    def __init__(self, groups, loader=None, exclude=(), budget=ASSET_BUDGET):
+        """
+        The function initializes a registry without loading anything.
+
+        :param groups: The `groups` parameter maps group names to an AssetSpec or a dictionary of
+        AssetSpecs, e.g. one Animation per action
+        :param loader: The `loader` parameter is the AssetLoader `preload` starts decoding on,
+        defaults to None (optional)
+        :param exclude: The `exclude` parameter is a container of image paths the loader should not
+        decode, typically the atlas, defaults to () (optional)
+        :param budget: The `budget` parameter is the approximate number of bytes of pixels kept
+        loaded, defaults to ASSET_BUDGET (optional)
+        """
+        self.groups = groups
+        self.loader = loader
+        self.exclude = exclude
+        self.budget = budget
+        self.loaded = OrderedDict()
+        self.sizes = {}
+        self.size = 0
+        self.pinned = set()
+        self.loads = 0
+        self.evictions = 0
+
+    def __contains__(self, name):
+        return name in self.groups
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __getitem__(self, key):
+        """
+        The function returns an asset group, loading it if needed.
+
+        :param key: The `key` parameter is a group name such as "particle/leaf", or a tuple such as
+        `("player", "run")` that indexes into the group
+        :return: the group, or the asset inside it.
+        """
+        if isinstance(key, tuple):
+            asset = self[key[0]]
+            for part in key[1:]:
+                asset = asset[part]
+            return asset
+        try:
+            group = self.loaded[key]
+        except KeyError:
+            return self.load(key)
+        self.loaded.move_to_end(key)
+        return group
+
+    def paths(self, name) -> list:
+        """
+        The function lists the image files and directories a group reads.
+
+        :param name: The `name` parameter is the group name
+        :return: a list of paths relative to BASE_IMG_PATH.
+        """
+        spec = self.groups[name]
+        specs = spec.values() if isinstance(spec, dict) else [spec]
+        return [path for spec in specs for path in spec.paths]
+
+    def load(self, name):
+        """
+        The function builds a group, then evicts other groups if the budget is exceeded.
+
+        :param name: The `name` parameter is the group name
+        :return: the group.
+        """
+        spec = self.groups[name]
+        if isinstance(spec, dict):
+            group = {key: value.build() for key, value in spec.items()}
+        else:
+            group = spec.build()
+        self.loaded[name] = group
+        self.sizes[name] = asset_bytes(group)
+        self.size += self.sizes[name]
+        self.loads += 1
+        self.evict(keep=name)
+        return group
+
+    def evict(self, keep=None):
+        """
+        The function drops the least recently used groups that are not pinned until the loaded pixels
+        fit in the budget. Objects already holding a dropped group keep working; the group is simply
+        loaded again the next time it is asked for.
+
+        :param keep: The `keep` parameter is a group that must stay loaded, defaults to None (optional)
+        """
+        for name in list(self.loaded):
+            if self.size <= self.budget:
+                return
+            if name != keep and name not in self.pinned:
+                del self.loaded[name]
+                self.size -= self.sizes.pop(name)
+                self.evictions += 1
+
+    def preload(self, names):
+        """
+        The function loads the groups a level declares and pins them. Their images are all decoded on
+        the loader's threads before the first one is converted.
+
+        :param names: The `names` parameter is an iterable of group names; unknown names are ignored
+        """
+        names = [name for name in dict.fromkeys(names) if name in self.groups]
+        if self.loader is not None:
+            for name in names:
+                if name not in self.loaded:
+                    for path in self.paths(name):
+                        if path.endswith(".png"):
+                            if path not in self.exclude:
+                                self.loader.request(path)
+                        else:
+                            self.loader.preload([path], exclude=self.exclude)
+        self.pinned.update(names)
+        for name in names:
+            self[name]
+
+    def release(self, names=None):
+        """
+        The function unpins groups, typically those of a level being left, so they can be evicted.
+
+        :param names: The `names` parameter is an iterable of group names, defaults to every pinned
+        group (optional)
+        """
+        if names is None:
+            self.pinned.clear()
+        else:
+            self.pinned.difference_update(names)
+        self.evict()
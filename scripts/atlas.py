@@ -0,0 +1,282 @@
+import os
+import sys
+import json
+import zlib
+import pygame
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.utils import BASE_IMG_PATH
+
+ATLAS_PATH = "data/atlas/"
+ATLAS_INDEX = "atlas.json"
+# Image directories, relative to BASE_IMG_PATH, whose PNGs are packed into the atlas.
+ATLAS_GROUPS = ["clouds", "entities", "particles", "tiles"]
+PAGE_SIZE = 1024
+PADDING = 1
+
+
+# The Atlas class serves images packed into a few large page surfaces as subsurface views.
+class Atlas:
+    def __init__(self, pages, images):
+        """
+        The function initializes an atlas from its decoded pages and its image index.
+
+        :param pages: The `pages` parameter is a list of unconverted page surfaces, as loaded from disk
+        :param images: The `images` parameter maps image paths relative to BASE_IMG_PATH, e.g.
+        "tiles/grass/0.png", to `[page, x, y, width, height]` lists
+        """
+        self.pages = pages
+        self.images = images
+        self.opaque_pages = {}
+        self.alpha_pages = {}
+        self.dirs = {}
+        for path in sorted(images):
+            folder, name = path.rsplit("/", 1) if "/" in path else ("", path)
+            self.dirs.setdefault(folder, []).append(name)
+
+    @classmethod
+    def load(cls, path=ATLAS_PATH, loader=None, validate=False):
+        """
+        The function loads an atlas written by `build_atlas`.
+
+        :param path: The `path` parameter is the directory holding the atlas index and pages, defaults
+        to ATLAS_PATH (optional)
+        :param loader: The `loader` parameter is a `scripts.assets.AssetLoader` to decode the pages on,
+        through its pixel cache, defaults to None (optional)
+        :param validate: The `validate` parameter checks the atlas against the source images and
+        leaves out the ones that changed since it was built, see `drop_stale`. This reads every source
+        image, so it is meant for tools that edit them, defaults to False (optional)
+        :return: an Atlas, or None if no atlas has been built at `path`.
+        """
+        try:
+            with open(os.path.join(path, ATLAS_INDEX), "r") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return None
+        if loader is not None:
+            pages = [loader.decode(os.path.join(path, page)) for page in index["pages"]]
+            pages = [page.result() for page in pages]
+        else:
+            pages = [
+                pygame.image.load(os.path.join(path, page)) for page in index["pages"]
+            ]
+        atlas = cls(pages, index["images"])
+        if validate:
+            atlas.drop_stale(index.get("sources", {}))
+        return atlas
+
+    def drop_stale(self, sources):
+        """
+        The function removes the images whose source file no longer matches the one that was packed,
+        and the directory listings that no longer match the source tree, so they are read from disk
+        instead.
+
+        :param sources: The `sources` parameter maps image paths relative to BASE_IMG_PATH to the
+        `[size, crc32]` of the packed file, as recorded by `build_atlas`
+        """
+        stale_images, stale_dirs = stale_sources(self.images, sources)
+        for rel_path in stale_images:
+            del self.images[rel_path]
+        for folder in stale_dirs:
+            del self.dirs[folder]
+
+    def __contains__(self, path):
+        return path in self.images
+
+    def listdir(self, path) -> list:
+        """
+        The function lists the packed images of a directory, like `os.listdir` on the source tree.
+
+        :param path: The `path` parameter is a directory relative to BASE_IMG_PATH, e.g. "tiles/grass"
+        :return: a sorted list of file names, or None if the directory is not in the atlas.
+        """
+        return self.dirs.get(path)
+
+    def image(self, path, transparent=False):
+        """
+        The function returns a packed image as a view into its page. Pages are converted for the display
+        on first use, once per mode.
+
+        :param path: The `path` parameter is an image path relative to BASE_IMG_PATH
+        :param transparent: The `transparent` parameter selects a per-pixel alpha view, matching
+        `load_transparent_image`, instead of a black colour-keyed one, matching `load_image`, defaults
+        to False (optional)
+        :return: a pygame.Surface subsurface.
+        """
+        page, x, y, width, height = self.images[path]
+        if transparent:
+            if page not in self.alpha_pages:
+                self.alpha_pages[page] = self.pages[page].convert_alpha()
+            surf = self.alpha_pages[page]
+        else:
+            if page not in self.opaque_pages:
+                self.opaque_pages[page] = self.pages[page].convert()
+                self.opaque_pages[page].set_colorkey((0, 0, 0))
+            surf = self.opaque_pages[page]
+        return surf.subsurface((x, y, width, height))
+
+
+def source_stamp(rel_path) -> list:
+    """
+    The function records the content of a source image, for `build_atlas` to store in the index. The
+    modification time is left out, since a checkout does not preserve it.
+
+    :param rel_path: The `rel_path` parameter is an image path relative to BASE_IMG_PATH
+    :return: a `[size, crc32]` list.
+    """
+    with open(BASE_IMG_PATH + rel_path, "rb") as f:
+        data = f.read()
+    return [len(data), zlib.crc32(data)]
+
+
+def stale_sources(images, sources) -> tuple:
+    """
+    The function compares an atlas index with the source images: a packed image is stale if its file
+    is gone or its size or CRC-32 changed, and a directory is stale if it holds a stale image or its
+    PNGs were added or removed.
+
+    :param images: The `images` parameter is the image index of the atlas, keyed by image paths
+    relative to BASE_IMG_PATH
+    :param sources: The `sources` parameter maps the same paths to the `[size, crc32]` lists from
+    `source_stamp`. Images missing from it are stale
+    :return: a `(stale_images, stale_dirs)` tuple of sorted lists.
+    """
+    dirs = {}
+    for rel_path in images:
+        folder, name = rel_path.rsplit("/", 1) if "/" in rel_path else ("", rel_path)
+        dirs.setdefault(folder, set()).add(name)
+    stale_images = []
+    stale_dirs = set()
+    for folder, names in dirs.items():
+        try:
+            found = {
+                name
+                for name in os.listdir(BASE_IMG_PATH + folder)
+                if name.endswith(".png")
+            }
+        except FileNotFoundError:
+            found = set()
+        if found != names:
+            stale_dirs.add(folder)
+    for rel_path in sorted(images):
+        try:
+            changed = source_stamp(rel_path) != sources.get(rel_path)
+        except FileNotFoundError:
+            changed = True
+        if changed:
+            stale_images.append(rel_path)
+            stale_dirs.add(rel_path.rsplit("/", 1)[0] if "/" in rel_path else "")
+    return stale_images, sorted(stale_dirs)
+
+
+def unkeyed(img):
+    """
+    The function turns an image into a per-pixel alpha surface with identical colour values, turning
+    colour-keyed pixels into fully transparent ones without changing their colour.
+
+    :param img: The `img` parameter is an unconverted surface loaded from a PNG
+    :return: a 32-bit SRCALPHA surface.
+    """
+    surf = pygame.Surface(img.get_size(), pygame.SRCALPHA)
+    surf.fill((0, 0, 0, 0))
+    raw = img.copy()
+    raw.set_colorkey(None)
+    surf.blit(raw, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+    if img.get_colorkey() is not None:
+        keep = pygame.mask.from_surface(img).to_surface(
+            setcolor=(255, 255, 255, 255), unsetcolor=(255, 255, 255, 0)
+        )
+        surf.blit(keep, (0, 0), special_flags=pygame.BLEND_RGBA_MIN)
+    return surf
+
+
+def build_atlas(groups=ATLAS_GROUPS, path=ATLAS_PATH, page_size=PAGE_SIZE) -> dict:
+    """
+    The function packs every PNG under the given image directories into page images with a shelf
+    packer and writes them to `path` together with a JSON index. Pixels are copied unchanged, so the
+    atlas serves both colour-keyed and per-pixel alpha loads.
+
+    :param groups: The `groups` parameter is a list of directories relative to BASE_IMG_PATH, searched
+    recursively, defaults to ATLAS_GROUPS (optional)
+    :param path: The `path` parameter is the output directory, defaults to ATLAS_PATH (optional)
+    :param page_size: The `page_size` parameter is the width and height of each page in pixels,
+    defaults to PAGE_SIZE (optional)
+    :return: the index that was written.
+    """
+    sources = {}
+    for group in groups:
+        for root, _, files in os.walk(BASE_IMG_PATH + group):
+            for name in files:
+                if name.endswith(".png"):
+                    full_path = os.path.join(root, name)
+                    rel_path = os.path.relpath(full_path, BASE_IMG_PATH).replace(
+                        os.sep, "/"
+                    )
+                    sources[rel_path] = unkeyed(pygame.image.load(full_path))
+
+    pages = []
+    images = {}
+    x = y = shelf_height = 0
+    for rel_path, img in sorted(
+        sources.items(), key=lambda item: (-item[1].get_height(), item[0])
+    ):
+        width, height = img.get_size()
+        if width + PADDING > page_size or height + PADDING > page_size:
+            raise ValueError(f"{rel_path} does not fit on a {page_size}px atlas page")
+        if x + width + PADDING > page_size:
+            x, y, shelf_height = 0, y + shelf_height, 0
+        if not pages or y + height + PADDING > page_size:
+            pages.append(pygame.Surface((page_size, page_size), pygame.SRCALPHA))
+            pages[-1].fill((0, 0, 0, 0))
+            x = y = shelf_height = 0
+        pages[-1].blit(img, (x, y), special_flags=pygame.BLEND_RGBA_MAX)
+        images[rel_path] = [len(pages) - 1, x, y, width, height]
+        x += width + PADDING
+        shelf_height = max(shelf_height, height + PADDING)
+
+    if pages:
+        pages[-1] = pages[-1].subsurface((0, 0, page_size, y + shelf_height)).copy()
+
+    os.makedirs(path, exist_ok=True)
+    index = {
+        "pages": [],
+        "images": dict(sorted(images.items())),
+        "sources": {rel_path: source_stamp(rel_path) for rel_path in sorted(images)},
+    }
+    for i, page in enumerate(pages):
+        index["pages"].append(f"atlas_{i}.png")
+        pygame.image.save(page, os.path.join(path, index["pages"][-1]))
+    with open(os.path.join(path, ATLAS_INDEX), "w") as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Pack the game's images into a texture atlas."
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="list the images that changed since the atlas was built instead of rebuilding it",
+    )
+    args = parser.parse_args()
+
+    if args.check:
+        with open(os.path.join(ATLAS_PATH, ATLAS_INDEX), "r") as f:
+            index = json.load(f)
+        stale_images, stale_dirs = stale_sources(
+            index["images"], index.get("sources", {})
+        )
+        for rel_path in stale_images:
+            print(f"changed: {rel_path}")
+        for folder in stale_dirs:
+            print(f"stale directory: {folder or '.'}")
+        sys.exit(1 if stale_dirs else 0)
+
+    index = build_atlas()
+    print(f"packed {len(index['images'])} images into {len(index['pages'])} page(s)")
@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep pygame's import banner out of the JSON written to stdout.
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from main import Game
+from scripts.entities import Enemy
+from scripts.entity_manager import ENEMY_SIZE
+from scripts.replay import Replay, ReplayDriver
+
+# Default input script: run right, jumping and dashing, then turn around. Each entry is
+# `[frame, action, pressed]`.
+DEFAULT_SCRIPT = [
+    [0, "right", True],
+    [60, "jump", True],
+    [120, "dash", True],
+    [180, "jump", True],
+    [200, "jump", True],
+    [300, "right", False],
+    [300, "left", True],
+    [360, "dash", True],
+    [420, "jump", True],
+    [540, "left", False],
+]
+
+
+def run_benchmark(map_path="map.json", frames=600, script=DEFAULT_SCRIPT, seed=0):
+    """
+    The function runs the game headless for a fixed number of frames, replaying a scripted input
+    sequence, and measures how long each subsystem takes per frame. Every frame is exactly one
+    simulation tick followed by one render, so runs are comparable across machines and commits.
+
+    :param map_path: The `map_path` parameter is the map to load, defaults to "map.json" (optional)
+    :param frames: The `frames` parameter is the number of frames to run, defaults to 600 (optional)
+    :param script: The `script` parameter is a list of `[frame, action, pressed]` inputs, defaults to
+    DEFAULT_SCRIPT (optional)
+    :param seed: The `seed` parameter seeds the game's random number generator, defaults to 0
+    (optional)
+    :return: a JSON-serializable dictionary with per-scope timings in milliseconds and the draw counts
+    of the last frame.
+    """
+    game = Game(headless=True, map_path=map_path, seed=seed)
+    game.profiler.enabled = True
+    game.profiler.window = None
+
+    inputs = {}
+    for frame, action, pressed in script:
+        inputs.setdefault(frame, []).append((action, pressed))
+
+    for frame in range(frames):
+        for action, pressed in inputs.get(frame, ()):
+            game.apply_input(action, pressed)
+        with game.profiler.scope("frame"):
+            game.step()
+            game.render()
+        game.profiler.end_frame()
+
+    return {
+        "map": map_path,
+        "frames": frames,
+        "seed": seed,
+        "timings_ms": game.profiler.summary(),
+        "counts": game.profiler.count_summary(),
+        "draw_counts": game.render_queue.report(),
+        "particles": len(game.particles),
+    }
+
+
+def run_replay_benchmark(replay):
+    """
+    The function runs the game headless through a recorded replay, measuring each frame like
+    `run_benchmark` and checking every tick against the recorded physics checksums.
+
+    :param replay: The `replay` parameter is a `scripts.replay.Replay`
+    :return: a JSON-serializable dictionary like the one of `run_benchmark`, plus the first tick that
+    diverged from the recording, or None.
+    """
+    game = Game(
+        headless=True,
+        map_path=replay.map_path,
+        seed=replay.seed,
+        render_size=replay.render_size,
+        stream_radius=replay.stream_radius,
+    )
+    game.profiler.enabled = True
+    game.profiler.window = None
+    driver = ReplayDriver(game, replay)
+
+    while not driver.done:
+        with game.profiler.scope("frame"):
+            driver.step()
+            game.render()
+        game.profiler.end_frame()
+
+    return {
+        "map": replay.map_path,
+        "frames": len(replay),
+        "seed": replay.seed,
+        "timings_ms": game.profiler.summary(),
+        "counts": game.profiler.count_summary(),
+        "draw_counts": game.render_queue.report(),
+        "particles": len(game.particles),
+        "divergence": driver.divergence,
+    }
+
+
+def run_entity_benchmark(map_path="map.json", count=1000, frames=300, seed=0):
+    """
+    The function measures the cost of entities themselves: the memory each enemy takes and the time
+    taken to update every enemy, awake or not, for a fixed number of ticks. Nothing is rendered.
+
+    :param map_path: The `map_path` parameter is the map to load, defaults to "map.json" (optional)
+    :param count: The `count` parameter is the number of enemies to spawn, defaults to 1000 (optional)
+    :param frames: The `frames` parameter is the number of ticks to run, defaults to 300 (optional)
+    :param seed: The `seed` parameter seeds the game's random number generator and the spawn
+    positions, defaults to 0 (optional)
+    :return: a JSON-serializable dictionary with bytes per enemy and update times in milliseconds.
+    """
+    game = Game(headless=True, map_path=map_path, seed=seed)
+    tiles = list(game.tilemap.tiles())
+    positions = []
+    for _ in range(count):
+        tile = game.rng.choice(tiles)
+        positions.append(
+            (
+                tile["pos"][0] * game.tilemap.tile_size,
+                (tile["pos"][1] - 1) * game.tilemap.tile_size,
+            )
+        )
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    enemies = [Enemy(game, pos, ENEMY_SIZE) for pos in positions]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tilemap = game.tilemap
+    times = []
+    for _ in range(frames):
+        start = time.perf_counter()
+        for enemy in enemies:
+            enemy.update(tilemap)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+
+    return {
+        "map": map_path,
+        "entities": count,
+        "frames": frames,
+        "seed": seed,
+        "bytes_per_entity": (after - before) / count,
+        "update_ms": {
+            "mean": sum(times) / frames,
+            "p50": times[frames // 2],
+            "max": times[-1],
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless frame-time benchmark.")
+    parser.add_argument("--map", default="map.json", help="map file to load")
+    parser.add_argument("--frames", type=int, default=600, help="frames to run")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--script", help="JSON file with a list of [frame, action, pressed] inputs"
+    )
+    parser.add_argument(
+        "--replay", help="replay file to run instead of the input script"
+    )
+    parser.add_argument(
+        "--entities",
+        type=int,
+        help="spawn this many enemies and time their updates instead of whole frames",
+    )
+    parser.add_argument("--out", help="write the report to this file instead of stdout")
+    args = parser.parse_args()
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script, "r") as f:
+            script = json.load(f)
+
+    if args.entities:
+        report = run_entity_benchmark(args.map, args.entities, args.frames, args.seed)
+    elif args.replay:
+        report = run_replay_benchmark(Replay.load(args.replay))
+    else:
+        report = run_benchmark(args.map, args.frames, script, args.seed)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
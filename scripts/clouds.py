@@ -1,80 +1,259 @@
 import random
+from collections import namedtuple
+import pygame
 
+# Depth bands the clouds are grouped into. A band's clouds are pre-composited into one surface, so
+# adding clouds to a band does not add blits.
+CLOUD_BANDS = 4
+# Smallest share of a band's composited surface its sprites must cover. Sparser bands, such as a few
+# clouds scattered over the whole view, blit their sprites one by one rather than a mostly empty
+# surface.
+COMPOSITE_MIN_FILL = 0.25
 
-class Cloud:
-    def __init__(self, pos, img, speed, depth):
+
+# The Cloud tuple records one generated cloud: its position, image, drift speed and depth. Clouds are
+# not drawn on their own; `Clouds` hands them to the band matching their depth.
+Cloud = namedtuple("Cloud", ["pos", "img", "speed", "depth"])
+
+
+# The ParallaxBand class is one layer of a scrolling background: a set of images that repeats every
+# `period` pixels and moves as a whole, at `depth` times the camera's speed plus its own drift.
+# Dense bands are composited into one surface the size of the area their images cover.
+class ParallaxBand:
+    def __init__(self, sprites, depth, speed=0.0, period=None, pos=(0, 0)):
         """
-        The function initializes an object with position, image, speed, and depth attributes.
+        The function initializes a band. It is laid out on the first `draw_list`.
 
-        :param pos: The pos parameter is a list that represents the position of an object. It contains
-        two elements, the x-coordinate and the y-coordinate of the object's position
-        :param img: The `img` parameter is used to store the image associated with the object. It can be
-        an image file path or an image object, depending on how it is used in the code
-        :param speed: The speed parameter represents the speed at which the object will move. It can be
-        a positive or negative value, indicating the direction and magnitude of the movement
-        :param depth: The depth parameter represents the layering or stacking order of the object. It
-        determines how objects are rendered on the screen, with objects with higher depth values
-        appearing on top of objects with lower depth values
+        :param sprites: The `sprites` parameter is a list of `(img, (x, y))` pairs. Positions are taken
+        modulo the period, and images crossing its edges wrap around
+        :param depth: The `depth` parameter is how far the band follows the camera, from 0 (fixed on
+        screen) to 1 (moves with the tiles)
+        :param speed: The `speed` parameter is the horizontal drift in pixels per `update`, defaults to
+        0.0 (optional)
+        :param period: The `period` parameter is the (width, height) after which the band repeats. A
+        None component wraps at the view size plus the largest sprite, like a single cloud does;
+        defaults to None (optional)
+        :param pos: The `pos` parameter is the band's starting offset, defaults to (0, 0) (optional)
         """
-        self.pos = list(pos)
-        self.img = img
-        self.speed = speed
+        self.sprites = sprites
         self.depth = depth
+        self.speed = speed
+        self.period = period
+        self.shift = list(pos)
+        self.pieces = None
+        self.period_size = None
+        self.view_size = None
 
     def update(self):
         """
-        The function updates the position of an object by adding its speed to its current position.
+        The function drifts the band by its speed.
         """
-        self.pos[0] += self.speed
+        self.shift[0] += self.speed
 
-    def render(self, surf, offset=(0, 0)):
+    def composite(self, size):
         """
-        The `render` function takes a surface and an offset, and blits an image onto the surface at a
-        position calculated based on the offset and the depth of the image.
+        The function lays the band out for a view of the given size. The sprites are drawn into a
+        surface only as large as the area they cover within one period: on each axis the period is cut
+        at the widest gap between sprites, and an axis the sprites leave no gap on is covered by exactly
+        one period, with the sprites crossing its end wrapped to its start. If the sprites would cover
+        less than COMPOSITE_MIN_FILL of that surface, they are kept as separate pieces instead.
 
-        :param surf: The `surf` parameter is the surface on which the image will be rendered. It is the
-        surface object that represents the display or a portion of it
-        :param offset: The `offset` parameter is a tuple representing the x and y offsets for rendering
-        the image. It is used to determine the position of the image on the surface (`surf`). The image
-        will be rendered at `self.pos[0] - offset[0] * self.depth` on the x-axis
+        :param size: The `size` parameter is the (width, height) of the surface the band is drawn on
         """
-        render_pos = (
-            self.pos[0] - offset[0] * self.depth,
-            self.pos[1] - offset[1] * self.depth,
-        )
-        surf.blit(
-            self.img,
-            (
-                render_pos[0] % (surf.get_width() + self.img.get_width())
-                - self.img.get_width(),
-                render_pos[1] % (surf.get_height() + self.img.get_height())
-                - self.img.get_height(),
-            ),
+        period = []
+        starts = []
+        origin = []
+        extent = []
+        # Where each sprite is blitted on each axis: once, or twice when it wraps around.
+        places = []
+        for axis in range(2):
+            lengths = [img.get_size()[axis] for img, _ in self.sprites]
+            if self.period is not None and self.period[axis] is not None:
+                length = int(self.period[axis])
+            else:
+                length = int(size[axis]) + max(lengths)
+            axis_starts = [int(pos[axis]) % length for _, pos in self.sprites]
+            cut = widest_gap_end(axis_starts, lengths, length)
+            local = [(start - cut) % length for start in axis_starts]
+            span = max(start + lengths[i] for i, start in enumerate(local))
+            if span < length:
+                places.append([[start] for start in local])
+            else:
+                cut, span = 0, length
+                places.append(
+                    [
+                        (
+                            [start, start - length]
+                            if start + lengths[i] > length
+                            else [start]
+                        )
+                        for i, start in enumerate(axis_starts)
+                    ]
+                )
+            period.append(length)
+            starts.append(axis_starts)
+            origin.append(cut)
+            extent.append(span)
+        self.period_size = tuple(period)
+        self.view_size = tuple(size)
+
+        covered = sum(img.get_width() * img.get_height() for img, _ in self.sprites)
+        if covered < COMPOSITE_MIN_FILL * extent[0] * extent[1]:
+            self.pieces = [
+                (img, (x, y), img.get_size())
+                for (img, _), x, y in zip(self.sprites, *starts)
+            ]
+            return
+
+        if any(img.get_flags() & pygame.SRCALPHA for img, _ in self.sprites):
+            surface = pygame.Surface(extent, pygame.SRCALPHA)
+            surface.fill((0, 0, 0, 0))
+        else:
+            surface = pygame.Surface(extent)
+            surface.fill((0, 0, 0))
+            surface.set_colorkey((0, 0, 0), pygame.RLEACCEL)
+        surface.blits(
+            [
+                (img, (x, y))
+                for (img, _), xs, ys in zip(self.sprites, places[0], places[1])
+                for x in xs
+                for y in ys
+            ],
+            doreturn=False,
         )
+        self.pieces = [(surface, tuple(origin), tuple(extent))]
+
+    def draw_list(self, size, offset=(0, 0)) -> list:
+        """
+        The function returns the copies of the band's pieces, one per period, that overlap a surface
+        of the given size. Copies entirely outside it are left out.
+
+        :param size: The `size` parameter is the (width, height) of the surface the band is drawn on
+        :param offset: The `offset` parameter is the camera scroll, defaults to (0, 0) (optional)
+        :return: a list of `(img, pos)` pairs.
+        """
+        if self.pieces is None or self.view_size != tuple(size):
+            self.composite(size)
+        width, height = size
+        period_x, period_y = self.period_size
+        base_x = self.shift[0] - offset[0] * self.depth - period_x
+        base_y = self.shift[1] - offset[1] * self.depth - period_y
+        items = []
+        for img, (origin_x, origin_y), (extent_x, extent_y) in self.pieces:
+            xs = []
+            x = (base_x + origin_x) % period_x - period_x
+            while x < width:
+                if x + extent_x > 0:
+                    xs.append(x)
+                x += period_x
+            y = (base_y + origin_y) % period_y - period_y
+            while y < height:
+                if y + extent_y > 0:
+                    items.extend((img, (x, y)) for x in xs)
+                y += period_y
+        return items
+
+
+def widest_gap_end(starts, lengths, period) -> int:
+    """
+    The function finds where to cut a wrapping axis so the sprites on it fit in the shortest span:
+    the end of the widest stretch of the period that no sprite covers.
 
+    :param starts: The `starts` parameter is the list of sprite positions on the axis, within the
+    period
+    :param lengths: The `lengths` parameter is the list of sprite sizes on the axis
+    :param period: The `period` parameter is the length after which the axis repeats
+    :return: the position, within the period, where the span holding every sprite starts.
+    """
+    spans = sorted(zip(starts, lengths))
+    reach = max(start + length for start, length in spans) - period
+    best_gap, best_end = -1, spans[0][0]
+    for start, length in spans:
+        if start - reach > best_gap:
+            best_gap, best_end = start - reach, start
+        reach = max(reach, start + length)
+    return best_end
 
-# The Clouds class is a blueprint for creating cloud objects.
+
+# The Clouds class is a blueprint for creating cloud objects. The clouds are grouped into depth bands
+# drawn as parallax layers, and further layers can be added behind or between them.
 class Clouds:
-    def __init__(self, cloud_images, count=16):
+    def __init__(self, cloud_images, count=16, rng=random, bands=CLOUD_BANDS):
+        """
+        The function scatters `count` clouds with random images, speeds and depths, and groups them
+        into bands of similar depth. Each band moves at the average depth and speed of its clouds.
+
+        :param cloud_images: The `cloud_images` parameter is the list of images to pick clouds from
+        :param count: The `count` parameter is the number of clouds, defaults to 16 (optional)
+        :param rng: The `rng` parameter is the random number generator to draw from, e.g. a seeded
+        `random.Random`, defaults to the `random` module (optional)
+        :param bands: The `bands` parameter is the number of depth bands, defaults to CLOUD_BANDS
+        (optional)
+        """
         self.clouds = []
 
         for i in range(count):
             self.clouds.append(
                 Cloud(
-                    (random.random() * 99999, random.random() * 99999),
-                    random.choice(cloud_images),
-                    random.random() * 0.06 + 0.13,
-                    random.random() * 0.6 + 0.2,
+                    (rng.random() * 99999, rng.random() * 99999),
+                    rng.choice(cloud_images),
+                    rng.random() * 0.06 + 0.13,
+                    rng.random() * 0.6 + 0.2,
                 )
             )
-            self.clouds.sort(key=lambda x: x.depth)
+        self.clouds.sort(key=lambda x: x.depth)
+
+        self.layers = []
+        if self.clouds:
+            near = self.clouds[-1].depth
+            far = self.clouds[0].depth
+            groups = [[] for _ in range(bands)]
+            for cloud in self.clouds:
+                index = (
+                    int((cloud.depth - far) / (near - far) * bands) if near > far else 0
+                )
+                groups[min(index, bands - 1)].append(cloud)
+            for group in groups:
+                if group:
+                    self.layers.append(
+                        ParallaxBand(
+                            [(cloud.img, cloud.pos) for cloud in group],
+                            sum(cloud.depth for cloud in group) / len(group),
+                            sum(cloud.speed for cloud in group) / len(group),
+                        )
+                    )
+
+    def add_layer(self, img, depth, speed=0.0, pos=(0, 0), repeat_y=False):
+        """
+        The function adds a background layer that repeats one image horizontally, e.g. a distant
+        skyline, drawn in depth order with the cloud bands.
+
+        :param img: The `img` parameter is the image to repeat
+        :param depth: The `depth` parameter is how far the layer follows the camera, see ParallaxBand
+        :param speed: The `speed` parameter is the horizontal drift in pixels per tick, defaults to 0.0
+        (optional)
+        :param pos: The `pos` parameter is the layer's starting offset, defaults to (0, 0) (optional)
+        :param repeat_y: The `repeat_y` parameter tiles the image vertically as well, instead of
+        wrapping it around the view like a cloud, defaults to False (optional)
+        :return: the new ParallaxBand.
+        """
+        layer = ParallaxBand(
+            [(img, (0, 0))],
+            depth,
+            speed,
+            period=(img.get_width(), img.get_height() if repeat_y else None),
+            pos=pos,
+        )
+        self.layers.append(layer)
+        self.layers.sort(key=lambda layer: layer.depth)
+        return layer
 
     def update(self):
         """
-        The function updates each cloud in a list of clouds.
+        The function drifts every layer.
         """
-        for cloud in self.clouds:
-            cloud.update()
+        for layer in self.layers:
+            layer.update()
 
     def render(self, surf, offset=(0, 0)):
         """
@@ -87,5 +266,16 @@ class Clouds:
         the rendering of the clouds on the surface. This can be used to adjust the position of the
         clouds on the surface
         """
-        for cloud in self.clouds:
-            cloud.render(surf, offset=offset)
+        surf.blits(self.draw_list(surf.get_size(), offset=offset), doreturn=False)
+
+    def draw_list(self, size, offset=(0, 0)) -> list:
+        """
+        The function returns the surfaces and screen positions of every layer, back to front, for a
+        surface of the given size.
+
+        :param size: The `size` parameter is the (width, height) of the surface the clouds are drawn on
+        :param offset: The offset parameter is a tuple that specifies the x and y coordinates to offset
+        the rendering of the clouds on the surface
+        :return: a list of `(img, pos)` pairs.
+        """
+        return [item for layer in self.layers for item in layer.draw_list(size, offset)]
@@ -1,12 +1,70 @@
 import math
-import random
 import pygame
-from scripts.particle import Particle
+from collections.abc import Mapping
+from scripts.utils import flip_image
+
+# Cell size of the broad-phase spatial hash that indexes entities by their rects.
+ENTITY_CELL_SIZE = 64
+
+# Bits of `Collisions.flags`, one per side an entity touched the tilemap on during its last update.
+COLLIDE_UP = 1
+COLLIDE_DOWN = 2
+COLLIDE_RIGHT = 4
+COLLIDE_LEFT = 8
+COLLISION_SIDES = {
+    "up": COLLIDE_UP,
+    "down": COLLIDE_DOWN,
+    "right": COLLIDE_RIGHT,
+    "left": COLLIDE_LEFT,
+}
+
+
+# The Collisions class holds the sides an entity collided on as a bitfield, read like the
+# `{"up": ..., "down": ..., "right": ..., "left": ...}` dictionary it replaces.
+class Collisions(Mapping):
+    __slots__ = ("flags",)
+
+    def __init__(self, flags=0):
+        """
+        The function initializes the collision state.
+
+        :param flags: The `flags` parameter is a combination of the COLLIDE_* bits, defaults to 0
+        (optional)
+        """
+        self.flags = flags
+
+    def __getitem__(self, side):
+        return bool(self.flags & COLLISION_SIDES[side])
+
+    def __iter__(self):
+        return iter(COLLISION_SIDES)
+
+    def __len__(self):
+        return len(COLLISION_SIDES)
+
+    def __repr__(self):
+        return repr(dict(self))
 
 
 # The PhysicsEntity class is a blueprint for creating objects that represent physical entities in a
 # simulation.
 class PhysicsEntity:
+    __slots__ = (
+        "game",
+        "type",
+        "pos",
+        "prev_pos",
+        "size",
+        "velocity",
+        "collisions",
+        "action",
+        "animation",
+        "animation_offset",
+        "flip",
+        "last_movement",
+        "hitbox",
+    )
+
     def __init__(self, game, entity_type, pos, size):
         """
         The function initializes an entity object with various attributes and sets the initial action to
@@ -26,9 +84,11 @@ class PhysicsEntity:
         self.game = game
         self.type = entity_type
         self.pos = list(pos)
+        self.prev_pos = list(pos)
         self.size = size
         self.velocity = [0, 0]
-        self.collisions = {"up": False, "down": False, "right": False, "left": False}
+        self.collisions = Collisions()
+        self.hitbox = pygame.Rect(self.pos, self.size)
 
         self.action = ""
         self.animation_offset = (-6, -6)
@@ -37,6 +97,8 @@ class PhysicsEntity:
 
         self.last_movement = [0, 0]
 
+        self.game.entity_hash.insert(self, self.bounds())
+
     def rect(self):
         """
         The function returns a pygame Rect object with the specified position and size.
@@ -44,6 +106,15 @@ class PhysicsEntity:
         """
         return pygame.Rect(self.pos[0], self.pos[1], self.size[0], self.size[1])
 
+    def bounds(self):
+        """
+        The function moves the entity's reusable `hitbox` rect to its current position, like `rect`
+        but without allocating one. The rect is overwritten by the next call, so copy it to keep it.
+        :return: the entity's `hitbox` pygame.Rect.
+        """
+        self.hitbox.update(self.pos, self.size)
+        return self.hitbox
+
     def set_action(self, action):
         """
         The function sets the action and animation of an object in a game.
@@ -53,7 +124,7 @@ class PhysicsEntity:
         """
         if action != self.action:
             self.action = action
-            self.animation = self.game.assets[self.type][self.action].copy()
+            self.animation = self.game.assets[self.type][self.action].cursor()
 
     def update(self, tilemap, movement=(0, 0)):
         """
@@ -68,7 +139,8 @@ class PhysicsEntity:
         either direction. The `update` method updates the position of the entity based on the movement
         and checks for collisions
         """
-        self.collisions = {"up": False, "down": False, "right": False, "left": False}
+        flags = 0
+        self.prev_pos[:] = self.pos
 
         frame_movement = (
             movement[0] + self.velocity[0],
@@ -76,27 +148,27 @@ class PhysicsEntity:
         )
 
         self.pos[0] += frame_movement[0]
-        entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos):
+        entity_rect = self.bounds()
+        for rect in tilemap.solid_rects(entity_rect, (frame_movement[0], 0)):
             if entity_rect.colliderect(rect):
                 if frame_movement[0] > 0:
                     entity_rect.right = rect.left
-                    self.collisions["right"] = True
+                    flags |= COLLIDE_RIGHT
                 if frame_movement[0] < 0:
                     entity_rect.left = rect.right
-                    self.collisions["left"] = True
+                    flags |= COLLIDE_LEFT
                 self.pos[0] = entity_rect.x
 
         self.pos[1] += frame_movement[1]
-        entity_rect = self.rect()
-        for rect in tilemap.physics_rects_around(self.pos):
+        entity_rect = self.bounds()
+        for rect in tilemap.solid_rects(entity_rect, (0, frame_movement[1])):
             if entity_rect.colliderect(rect):
                 if frame_movement[1] > 0:
                     entity_rect.bottom = rect.top
-                    self.collisions["down"] = True
+                    flags |= COLLIDE_DOWN
                 if frame_movement[1] < 0:
                     entity_rect.top = rect.bottom
-                    self.collisions["up"] = True
+                    flags |= COLLIDE_UP
                 self.pos[1] = entity_rect.y
 
         if movement[0] > 0:
@@ -108,11 +180,42 @@ class PhysicsEntity:
 
         self.velocity[1] = min(5, self.velocity[1] + 0.1)
 
-        if self.collisions["down"] or self.collisions["up"]:
+        self.collisions.flags = flags
+        if flags & (COLLIDE_DOWN | COLLIDE_UP):
             self.velocity[1] = 0
 
+        # `entity_rect` is the hitbox, already in step with the final position.
+        self.game.entity_hash.move(self, entity_rect)
+
         self.animation.update()
 
+    def overlapping(self) -> list:
+        """
+        The function returns the other entities whose rects overlap this one, e.g. for projectile hits
+        or dash collisions, using the game's entity spatial hash.
+        :return: a list of entities.
+        """
+        return [
+            entity
+            for entity in self.game.entity_hash.query_rect(self.bounds())
+            if entity is not self
+        ]
+
+    def nearby(self, radius) -> list:
+        """
+        The function returns the other entities within `radius` pixels of this entity's center.
+
+        :param radius: The `radius` parameter is the search distance in pixels
+        :return: a list of entities.
+        """
+        return [
+            entity
+            for entity in self.game.entity_hash.query_radius(
+                self.bounds().center, radius
+            )
+            if entity is not self
+        ]
+
     def render(self, surf, offset=(0, 0)):
         """
         The `render` function blits the flipped animation image onto a surface at a specified position
@@ -125,17 +228,90 @@ class PhysicsEntity:
         subtracting the offset from the position (`self.pos`) and adding the animation offset
         (`self.animation_offset`), the
         """
-        surf.blit(
-            pygame.transform.flip(self.animation.img(), self.flip, False),
-            [
-                self.pos[0] - offset[0] + self.animation_offset[0],
-                self.pos[1] - offset[1] + self.animation_offset[1],
-            ],
-        )
+        surf.blits(self.draw_list(surf.get_size(), offset=offset), doreturn=False)
+
+    def draw_list(self, size, offset=(0, 0), alpha=1.0) -> list:
+        """
+        The function returns the entity's current, possibly flipped, animation image and its screen
+        position.
+
+        :param size: The `size` parameter is the (width, height) of the surface the entity is drawn on
+        :param offset: The `offset` parameter is the camera scroll, defaults to (0, 0) (optional)
+        :param alpha: The `alpha` parameter places the entity between its position before the last
+        update (0) and its current position (1), defaults to 1.0 (optional)
+        :return: a list of `(img, pos)` pairs.
+        """
+        img = self.animation.img()
+        return [
+            (
+                flip_image(img) if self.flip else img,
+                (
+                    self.prev_pos[0]
+                    + (self.pos[0] - self.prev_pos[0]) * alpha
+                    - offset[0]
+                    + self.animation_offset[0],
+                    self.prev_pos[1]
+                    + (self.pos[1] - self.prev_pos[1]) * alpha
+                    - offset[1]
+                    + self.animation_offset[1],
+                ),
+            )
+        ]
+
+
+# The Enemy class is a PhysicsEntity that patrols back and forth along the ground.
+class Enemy(PhysicsEntity):
+    __slots__ = ("walking",)
+
+    def __init__(self, game, pos, size):
+        """
+        The function initializes an enemy standing still.
+
+        :param game: The "game" parameter is a reference to the game object that the enemy belongs to
+        :param pos: The "pos" parameter is the (x, y) position of the enemy in world pixels
+        :param size: The "size" parameter is the (width, height) of the enemy's hitbox
+        """
+        super().__init__(game, "enemy", pos, size)
+        self.animation_offset = (-3, -3)
+        self.walking = 0
+
+    def update(self, tilemap, movement=(0, 0)):
+        """
+        The function moves the enemy: while it is walking it keeps going until the ground ahead ends or
+        it runs into a wall, then turns around; while it stands it sometimes starts a new walk.
+
+        :param tilemap: The `tilemap` parameter is the game's tilemap, used for collisions and to look
+        for ground ahead
+        :param movement: The `movement` parameter is extra (x, y) movement on top of the patrol,
+        defaults to (0, 0) (optional)
+        """
+        if self.walking:
+            rect = self.bounds()
+            if tilemap.solid_at(
+                (rect.centerx + (-7 if self.flip else 7), self.pos[1] + 23)
+            ):
+                if self.collisions.flags & (COLLIDE_RIGHT | COLLIDE_LEFT):
+                    self.flip = not self.flip
+                else:
+                    movement = (movement[0] + (-0.5 if self.flip else 0.5), movement[1])
+            else:
+                self.flip = not self.flip
+            self.walking = max(0, self.walking - 1)
+        elif self.game.rng.random() < 0.01:
+            self.walking = self.game.rng.randint(30, 120)
+
+        super().update(tilemap, movement=movement)
+
+        if movement[0] != 0:
+            self.set_action("run")
+        else:
+            self.set_action("idle")
 
 
 # The Player class is a subclass of the PhysicsEntity class.
 class Player(PhysicsEntity):
+    __slots__ = ("air_time", "jumps", "wall_jumps", "dashing")
+
     def __init__(self, game, pos, size):
         """
         The function initializes a player object with a game, position, and size, and sets the air_time
@@ -202,18 +378,19 @@ class Player(PhysicsEntity):
         """
         super().update(tilemap, movement=movement)
 
+        flags = self.collisions.flags
         self.air_time += 1
-        if self.collisions["down"]:
+        if flags & COLLIDE_DOWN:
             self.air_time = 0
             self.jumps = 2
 
         self.wall_jumps = False
 
-        if (self.collisions["right"] or self.collisions["left"]) and self.air_time > 4:
+        if flags & (COLLIDE_RIGHT | COLLIDE_LEFT) and self.air_time > 4:
             self.wall_jumps = True
             self.velocity[1] = min(self.velocity[1], 0.5)
 
-            self.flip = not self.collisions["right"]
+            self.flip = not flags & COLLIDE_RIGHT
 
             self.set_action("wall_jump")
 
@@ -226,19 +403,16 @@ class Player(PhysicsEntity):
                 self.set_action("idle")
 
         if abs(self.dashing) in (60, 50):
+            burst_velocities = []
             for _ in range(20):
-                angle = random.random() * math.pi * 2
-                speed = random.random() * 0.5 + 0.5
-                particle_velocity = [math.cos(angle) * speed, math.sin(angle) * speed]
-                self.game.particles.append(
-                    Particle(
-                        self.game,
-                        "particle",
-                        self.rect().center,
-                        velocity=particle_velocity,
-                        frame=random.randint(0, 7),
-                    )
+                angle = self.game.rng.random() * math.pi * 2
+                speed = self.game.rng.random() * 0.5 + 0.5
+                burst_velocities.append(
+                    [math.cos(angle) * speed, math.sin(angle) * speed]
                 )
+            self.game.particles.spawn_many(
+                "particle", self.bounds().center, velocity=burst_velocities
+            )
 
         if self.dashing > 0:
             self.dashing = max(self.dashing - 1, 0)
@@ -250,17 +424,11 @@ class Player(PhysicsEntity):
                 self.velocity[0] *= 0.1
 
             particle_velocity = [
-                abs(self.dashing) / self.dashing * random.random() * 3,
+                abs(self.dashing) / self.dashing * self.game.rng.random() * 3,
                 0,
             ]
-            self.game.particles.append(
-                Particle(
-                    self.game,
-                    "particle",
-                    self.rect().center,
-                    velocity=particle_velocity,
-                    frame=random.randint(0, 7),
-                )
+            self.game.particles.spawn(
+                "particle", self.bounds().center, velocity=particle_velocity
             )
 
         if self.velocity[0] > 0:
@@ -268,6 +436,7 @@ class Player(PhysicsEntity):
         else:
             self.velocity[0] = min(self.velocity[0] + 0.1, 0)
 
-    def render(self, surf, offset=(0, 0)):
+    def draw_list(self, size, offset=(0, 0), alpha=1.0) -> list:
         if abs(self.dashing) <= 50:
-            super().render(surf, offset=offset)
+            return super().draw_list(size, offset=offset, alpha=alpha)
+        return []
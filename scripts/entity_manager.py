@@ -0,0 +1,153 @@
+from scripts.entities import Enemy
+
+# Spawner marker variants placed in the level editor.
+SPAWNER_PLAYER = 0
+SPAWNER_ENEMY = 1
+ENEMY_SIZE = (8, 15)
+
+# Entities within this many pixels of the camera are simulated; the rest sleep.
+WAKE_MARGIN = 128
+# Extra distance an awake entity may move beyond WAKE_MARGIN before it falls asleep again, so
+# entities on the edge do not toggle every tick.
+SLEEP_MARGIN = 64
+
+
+# The EntityManager class holds the game's non-player entities. Each tick it only updates the ones
+# near the camera, found through the game's entity spatial hash, and leaves the others asleep.
+class EntityManager:
+    def __init__(self, game, wake_margin=WAKE_MARGIN, sleep_margin=SLEEP_MARGIN):
+        """
+        The function initializes an empty manager.
+
+        :param game: The "game" parameter is the game the entities belong to. Its `entity_hash` is used
+        to find the entities near the camera
+        :param wake_margin: The `wake_margin` parameter is how far outside the camera, in pixels,
+        sleeping entities wake up, defaults to WAKE_MARGIN (optional)
+        :param sleep_margin: The `sleep_margin` parameter is how much further an awake entity may be
+        before it falls asleep, defaults to SLEEP_MARGIN (optional)
+        """
+        self.game = game
+        self.wake_margin = wake_margin
+        self.sleep_margin = sleep_margin
+        self.entities = {}
+        self.spawn_order = {}
+        self.spawned = 0
+        self.awake = []
+
+    def __len__(self):
+        return len(self.entities)
+
+    def __iter__(self):
+        return iter(self.entities.values())
+
+    @property
+    def active(self) -> int:
+        """
+        The function returns the number of awake entities.
+        :return: the number of entities updated last tick.
+        """
+        return len(self.awake)
+
+    @property
+    def sleeping(self) -> int:
+        """
+        The function returns the number of sleeping entities.
+        :return: the number of entities skipped last tick.
+        """
+        return len(self.entities) - len(self.awake)
+
+    def add(self, entity):
+        """
+        The function starts managing an entity. It sleeps until the next `update` finds it near the
+        camera.
+
+        :param entity: The `entity` parameter is a PhysicsEntity of the game
+        """
+        self.entities[id(entity)] = entity
+        self.spawn_order[id(entity)] = self.spawned
+        self.spawned += 1
+
+    def remove(self, entity):
+        """
+        The function stops managing an entity and takes it out of the game's entity hash.
+
+        :param entity: The `entity` parameter is a managed entity
+        """
+        del self.entities[id(entity)]
+        del self.spawn_order[id(entity)]
+        if entity in self.awake:
+            self.awake.remove(entity)
+        self.game.entity_hash.remove(entity)
+
+    def spawn_from_map(self, tilemap):
+        """
+        The function replaces the spawner markers of a map with entities: the player marker moves the
+        player, and every enemy marker becomes an Enemy. The markers are removed from the map.
+
+        :param tilemap: The `tilemap` parameter is the TileMap to read the markers from, or the
+        `scripts.streaming.ChunkStreamer` streaming it, which also finds the markers of chunks that
+        are not loaded yet
+        :return: the number of enemies spawned.
+        """
+        spawned = 0
+        for spawner in tilemap.extract(
+            [("spawners", SPAWNER_PLAYER), ("spawners", SPAWNER_ENEMY)]
+        ):
+            if spawner["variant"] == SPAWNER_PLAYER:
+                player = self.game.player
+                player.pos = list(spawner["pos"])
+                player.prev_pos = list(spawner["pos"])
+                self.game.entity_hash.move(player, player.bounds())
+            else:
+                self.add(Enemy(self.game, spawner["pos"], ENEMY_SIZE))
+                spawned += 1
+        return spawned
+
+    def update(self, camera):
+        """
+        The function wakes the entities near the camera, puts the ones that drifted away to sleep and
+        updates the awake ones, in the order they were spawned.
+
+        :param camera: The `camera` parameter is the pygame.Rect the camera shows, in world pixels
+        """
+        spawn_order = self.spawn_order
+        keep = {
+            id(entity)
+            for entity in self.game.entity_hash.query_rect(
+                camera.inflate(
+                    2 * (self.wake_margin + self.sleep_margin),
+                    2 * (self.wake_margin + self.sleep_margin),
+                )
+            )
+        }
+        awake = {id(entity): entity for entity in self.awake if id(entity) in keep}
+        for entity in self.game.entity_hash.query_rect(
+            camera.inflate(2 * self.wake_margin, 2 * self.wake_margin)
+        ):
+            if id(entity) in spawn_order:
+                awake[id(entity)] = entity
+        self.awake = sorted(awake.values(), key=lambda entity: spawn_order[id(entity)])
+
+        tilemap = self.game.tilemap
+        streamer = self.game.streamer
+        for entity in self.awake:
+            # Like the player's, the chunks under an awake entity must not depend on how far the
+            # loader thread has got, or streamed runs would not replay.
+            if streamer is not None:
+                streamer.require(entity.pos)
+            entity.update(tilemap)
+
+    def draw_list(self, size, offset=(0, 0), alpha=1.0) -> list:
+        """
+        The function returns the images of the awake entities. Sleeping entities are never on screen.
+
+        :param size: The `size` parameter is the (width, height) of the surface the entities are drawn on
+        :param offset: The `offset` parameter is the camera scroll, defaults to (0, 0) (optional)
+        :param alpha: The `alpha` parameter is the interpolation factor passed to each entity's
+        `draw_list`, defaults to 1.0 (optional)
+        :return: a list of `(img, pos)` pairs.
+        """
+        items = []
+        for entity in self.awake:
+            items.extend(entity.draw_list(size, offset=offset, alpha=alpha))
+        return items
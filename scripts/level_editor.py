@@ -1,14 +1,32 @@
+import os
 import pygame
 import sys
 import contextlib
-from utils import load_image, load_images, load_transparent_images, Animation
-from tilemap import TileMap
 
-RENDER_SCALE = 2.0
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.utils import (
+    load_image,
+    load_images,
+    load_transparent_images,
+    use_atlas,
+    use_loader,
+    Animation,
+)
+from scripts.atlas import Atlas
+from scripts.assets import AssetLoader
+from scripts.tilemap import TileMap
+from scripts.renderer import Presenter, SCALE_NEAREST
 
 
 class LevelEditor:
-    def __init__(self):
+    def __init__(self, scaling=SCALE_NEAREST):
+        """
+        The function initializes the editor window and loads "map.json" if it exists.
+
+        :param scaling: The `scaling` parameter is how frames are scaled to the window, one of
+        `scripts.renderer.SCALE_MODES`, defaults to SCALE_NEAREST (optional)
+        """
         pygame.init()
 
         self.WIDTH, self.HEIGHT = 1920, 1010
@@ -16,8 +34,19 @@ class LevelEditor:
 
         pygame.display.set_caption("Level Editor")
 
-        self.screen = pygame.display.set_mode((self.WIDTH, self.HEIGHT))
-        self.display = pygame.Surface((self.WIDTH / 2, self.HEIGHT / 2))
+        self.presenter = Presenter(
+            (self.WIDTH, self.HEIGHT),
+            (self.WIDTH / 2, self.HEIGHT / 2),
+            scaling=scaling,
+        )
+        self.screen = self.presenter.screen
+        self.display = self.presenter.display
+
+        loader = AssetLoader()
+        atlas = Atlas.load(loader=loader, validate=True)
+        use_atlas(atlas)
+        use_loader(loader)
+        loader.preload(["tiles"], exclude=atlas if atlas is not None else ())
 
         self.clock = pygame.time.Clock()
 
@@ -26,7 +55,11 @@ class LevelEditor:
             "grass": load_images("tiles/grass"),
             "large_decor": load_images("tiles/large_decor"),
             "stone": load_images("tiles/stone"),
+            "spawners": load_images("tiles/spawners"),
         }
+        use_loader(None)
+        loader.save_cache()
+        loader.close()
 
         self.movement = [False, False, False, False]
 
@@ -68,8 +101,7 @@ class LevelEditor:
             ].copy()
             current_tile_img.set_alpha(100)
 
-            mouse_pos = pygame.mouse.get_pos()
-            mouse_pos = (mouse_pos[0] / RENDER_SCALE, mouse_pos[1] / RENDER_SCALE)
+            mouse_pos = self.presenter.to_render(pygame.mouse.get_pos())
             tile_pos = (
                 int((mouse_pos[0] + self.scroll[0]) // self.tilemap.tile_size),
                 int((mouse_pos[1] + self.scroll[1]) // self.tilemap.tile_size),
@@ -87,26 +119,19 @@ class LevelEditor:
                 self.display.blit(current_tile_img, mouse_pos)
 
             if self.clicking and self.ongrid:
-                self.tilemap.tilemap[f"{tile_pos[0]};{tile_pos[1]}"] = {
-                    "type": self.tile_list[self.tile_group],
-                    "variant": self.tile_variant,
-                    "pos": tile_pos,
-                }
+                self.tilemap.set_tile(
+                    tile_pos[0],
+                    tile_pos[1],
+                    self.tile_list[self.tile_group],
+                    self.tile_variant,
+                )
 
             if self.right_clicking:
-                tile_location = f"{tile_pos[0]};{tile_pos[1]}"
-                if tile_location in self.tilemap.tilemap:
-                    del self.tilemap.tilemap[tile_location]
-                for tile in self.tilemap.offgrid_tiles.copy():
-                    tile_image = self.assets[tile["type"]][tile["variant"]]
-                    tile_r = pygame.Rect(
-                        tile["pos"][0] - self.scroll[0],
-                        tile["pos"][1] - self.scroll[1],
-                        tile_image.get_width(),
-                        tile_image.get_height(),
-                    )
-                    if tile_r.collidepoint(mouse_pos):
-                        self.tilemap.offgrid_tiles.remove(tile)
+                self.tilemap.remove_tile(tile_pos[0], tile_pos[1])
+                for tile in self.tilemap.offgrid_at(
+                    (mouse_pos[0] + self.scroll[0], mouse_pos[1] + self.scroll[1])
+                ):
+                    self.tilemap.remove_offgrid(tile)
 
             self.display.blit(current_tile_img, (10, 10))
 
@@ -119,7 +144,7 @@ class LevelEditor:
                     if event.button == 1:
                         self.clicking = True
                         if not self.ongrid:
-                            self.tilemap.offgrid_tiles.append(
+                            self.tilemap.add_offgrid(
                                 {
                                     "type": self.tile_list[self.tile_group],
                                     "variant": self.tile_variant,
@@ -176,6 +201,11 @@ class LevelEditor:
                     if event.key == pygame.K_t:
                         self.tilemap.autotile()
 
+                    if event.key == pygame.K_r:
+                        self.tilemap.autotile_on_edit = (
+                            not self.tilemap.autotile_on_edit
+                        )
+
                     if event.key == pygame.K_o:
                         self.tilemap.save("map.json")
 
@@ -195,11 +225,8 @@ class LevelEditor:
                     if event.key in (pygame.K_LSHIFT, pygame.K_RSHIFT):
                         self.shift_down = False
 
-            self.screen.blit(
-                pygame.transform.scale(self.display, self.screen.get_size()), (0, 0)
-            )
-
-            pygame.display.update()
+            self.presenter.present()
+            self.presenter.flip()
             self.clock.tick(self.FPS)
 
 
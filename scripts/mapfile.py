@@ -0,0 +1,319 @@
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+MAP_EXTENSION = ".map"
+MAP_MAGIC = b"GMMP"
+MAP_VERSION = 2
+
+# magic, version, tile size, chunk size, type count, chunk count, offgrid count
+HEADER_FORMAT = "<4sHHHHII"
+# chunk x, chunk y, byte offset of the chunk's arrays, number of filled cells, type mask
+CHUNK_INDEX_FORMAT = "<iiIHQ"
+# Bits in a chunk's type mask. Type id n sets bit n; ids past the last bit share it.
+TYPE_MASK_BITS = 64
+# type id, variant, x, y
+OFFGRID_FORMAT = "<Hhdd"
+# flags and length of a tile type name in the string table
+STRING_FORMAT = "<BB"
+# string table flag of tile types placed on the grid, as opposed to offgrid only
+GRID_TYPE = 1
+EMPTY_CELL = -1
+
+
+def write_map(path, tile_size, chunk_size, tiles, offgrid):
+    """
+    The function writes a map in the binary format read by `MapFile`: a header, a string table of
+    tile types flagged by whether they appear on the grid, an index of chunks with a mask of the
+    types each one holds, the offgrid tiles, and then two packed int16 arrays per chunk holding the
+    type id and variant of every cell.
+
+    :param path: The `path` parameter is the file to write
+    :param tile_size: The `tile_size` parameter is the size of a tile in pixels
+    :param chunk_size: The `chunk_size` parameter is the width and height of a chunk in tiles
+    :param tiles: The `tiles` parameter is an iterable of grid tile dictionaries with "type",
+    "variant" and "pos" keys, "pos" in tile coordinates
+    :param offgrid: The `offgrid` parameter is an iterable of offgrid tile dictionaries, "pos" in
+    pixels
+    """
+    tile_types = {}
+    grid_type_ids = set()
+    cells = chunk_size * chunk_size
+    chunks = {}
+    for tile in tiles:
+        x, y = tile["pos"]
+        key = (x // chunk_size, y // chunk_size)
+        if key not in chunks:
+            chunks[key] = (
+                array("h", [EMPTY_CELL]) * cells,
+                array("h", [0]) * cells,
+            )
+        types, variants = chunks[key]
+        index = (y % chunk_size) * chunk_size + x % chunk_size
+        types[index] = tile_types.setdefault(tile["type"], len(tile_types))
+        variants[index] = tile["variant"]
+        grid_type_ids.add(types[index])
+    offgrid = [
+        (
+            tile_types.setdefault(tile["type"], len(tile_types)),
+            tile["variant"],
+            tile["pos"][0],
+            tile["pos"][1],
+        )
+        for tile in offgrid
+    ]
+
+    strings = b"".join(
+        struct.pack(
+            STRING_FORMAT,
+            GRID_TYPE if type_id in grid_type_ids else 0,
+            len(name.encode("utf-8")),
+        )
+        + name.encode("utf-8")
+        for name, type_id in tile_types.items()
+    )
+    offset = (
+        struct.calcsize(HEADER_FORMAT)
+        + len(strings)
+        + len(chunks) * struct.calcsize(CHUNK_INDEX_FORMAT)
+        + len(offgrid) * struct.calcsize(OFFGRID_FORMAT)
+    )
+    index = []
+    data = []
+    for (cx, cy), (types, variants) in sorted(chunks.items()):
+        count = cells - types.count(EMPTY_CELL)
+        index.append(
+            struct.pack(
+                CHUNK_INDEX_FORMAT,
+                cx,
+                cy,
+                offset,
+                count,
+                type_mask(set(types) - {EMPTY_CELL}),
+            )
+        )
+        if sys.byteorder == "big":
+            types, variants = array("h", types), array("h", variants)
+            types.byteswap()
+            variants.byteswap()
+        data.append(types.tobytes() + variants.tobytes())
+        offset += 4 * cells
+
+    with open(path, "wb") as f:
+        f.write(
+            struct.pack(
+                HEADER_FORMAT,
+                MAP_MAGIC,
+                MAP_VERSION,
+                tile_size,
+                chunk_size,
+                len(tile_types),
+                len(chunks),
+                len(offgrid),
+            )
+        )
+        f.write(strings)
+        f.writelines(index)
+        f.writelines(struct.pack(OFFGRID_FORMAT, *tile) for tile in offgrid)
+        f.writelines(data)
+
+
+def type_mask(type_ids) -> int:
+    """
+    The function packs a set of type ids into a chunk index type mask.
+
+    :param type_ids: The `type_ids` parameter is an iterable of tile type ids
+    :return: an integer with the bit of every type id set.
+    """
+    mask = 0
+    for type_id in type_ids:
+        mask |= 1 << min(type_id, TYPE_MASK_BITS - 1)
+    return mask
+
+
+# The MapFile class reads a binary map through a memory map. The header, string table, chunk index and
+# offgrid tiles are parsed when the file is opened; chunk arrays are only decoded when asked for.
+class MapFile:
+    def __init__(self, path):
+        """
+        The function opens and maps a binary map file written by `write_map`.
+
+        :param path: The `path` parameter is the file to open
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (
+            magic,
+            version,
+            self.tile_size,
+            self.chunk_size,
+            type_count,
+            chunk_count,
+            offgrid_count,
+        ) = struct.unpack_from(HEADER_FORMAT, self.data)
+        if magic != MAP_MAGIC or version != MAP_VERSION:
+            self.data.close()
+            raise ValueError(f"{path} is not a version {MAP_VERSION} map file")
+        offset = struct.calcsize(HEADER_FORMAT)
+
+        self.tile_types = []
+        self.grid_type_ids = set()
+        for type_id in range(type_count):
+            flags, length = struct.unpack_from(STRING_FORMAT, self.data, offset)
+            offset += struct.calcsize(STRING_FORMAT)
+            self.tile_types.append(self.data[offset : offset + length].decode("utf-8"))
+            if flags & GRID_TYPE:
+                self.grid_type_ids.add(type_id)
+            offset += length
+
+        self.index = {}
+        self.type_masks = {}
+        for cx, cy, chunk_offset, count, mask in struct.iter_unpack(
+            CHUNK_INDEX_FORMAT,
+            self.data[
+                offset : offset + chunk_count * struct.calcsize(CHUNK_INDEX_FORMAT)
+            ],
+        ):
+            self.index[(cx, cy)] = (chunk_offset, count)
+            self.type_masks[(cx, cy)] = mask
+        offset += chunk_count * struct.calcsize(CHUNK_INDEX_FORMAT)
+
+        self.offgrid = [
+            {"type": self.tile_types[type_id], "variant": variant, "pos": [x, y]}
+            for type_id, variant, x, y in struct.iter_unpack(
+                OFFGRID_FORMAT,
+                self.data[
+                    offset : offset + offgrid_count * struct.calcsize(OFFGRID_FORMAT)
+                ],
+            )
+        ]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        """
+        The function unmaps the file. Chunks can no longer be decoded afterwards.
+        """
+        self.data.close()
+
+    def chunk(self, key) -> tuple:
+        """
+        The function decodes the arrays of one chunk.
+
+        :param key: The `key` parameter is the (cx, cy) chunk coordinate, which must be in `index`
+        :return: a `(types, variants, count)` tuple of two int16 arrays indexed by
+        `y * chunk_size + x` and the number of filled cells. Type ids index `tile_types`.
+        """
+        offset, count = self.index[key]
+        size = 2 * self.chunk_size * self.chunk_size
+        types = array("h")
+        types.frombytes(self.data[offset : offset + size])
+        variants = array("h")
+        variants.frombytes(self.data[offset + size : offset + 2 * size])
+        if sys.byteorder == "big":
+            types.byteswap()
+            variants.byteswap()
+        return types, variants, count
+
+    def holding(self, type_ids) -> list:
+        """
+        The function finds the chunks that may hold tiles of the given types from the chunk index,
+        without decoding any chunk.
+
+        :param type_ids: The `type_ids` parameter is an iterable of tile type ids
+        :return: a list of (cx, cy) chunk coordinates, in file order.
+        """
+        mask = type_mask(type_ids)
+        return [key for key, chunk_mask in self.type_masks.items() if chunk_mask & mask]
+
+    def tiles(self, type_ids=None):
+        """
+        The function iterates over the grid tiles in the file, decoding each chunk in turn.
+
+        :param type_ids: The `type_ids` parameter is a set of tile type ids to limit the tiles to. Only
+        the chunks the index lists as holding one of them are decoded, defaults to every type
+        (optional)
+        :return: a generator of tile dictionaries with "type", "variant" and "pos" keys.
+        """
+        size = self.chunk_size
+        keys = self.index if type_ids is None else self.holding(type_ids)
+        for cx, cy in keys:
+            types, variants, _ = self.chunk((cx, cy))
+            for index, type_id in enumerate(types):
+                if type_id != EMPTY_CELL and (type_ids is None or type_id in type_ids):
+                    yield {
+                        "type": self.tile_types[type_id],
+                        "variant": variants[index],
+                        "pos": [cx * size + index % size, cy * size + index // size],
+                    }
+
+
+def json_to_binary(src, dst, chunk_size):
+    """
+    The function converts a JSON map saved by `TileMap.save` to the binary format.
+
+    :param src: The `src` parameter is the JSON map to read
+    :param dst: The `dst` parameter is the binary map to write
+    :param chunk_size: The `chunk_size` parameter is the width and height of a chunk in tiles
+    """
+    with open(src, "r") as f:
+        map_data = json.load(f)
+    write_map(
+        dst,
+        map_data["tile_size"],
+        chunk_size,
+        map_data["tilemap"].values(),
+        map_data["offgrid"],
+    )
+
+
+def binary_to_json(src, dst):
+    """
+    The function converts a binary map back to the JSON format of `TileMap.save`.
+
+    :param src: The `src` parameter is the binary map to read
+    :param dst: The `dst` parameter is the JSON map to write
+    """
+    with MapFile(src) as map_file:
+        map_data = {
+            "tilemap": {
+                f"{tile['pos'][0]};{tile['pos'][1]}": tile for tile in map_file.tiles()
+            },
+            "tile_size": map_file.tile_size,
+            "offgrid": map_file.offgrid,
+        }
+    with open(dst, "w") as f:
+        json.dump(map_data, f)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import argparse
+    from scripts.tilemap import CHUNK_SIZE
+
+    parser = argparse.ArgumentParser(
+        description=f"Convert maps between JSON and the binary {MAP_EXTENSION} format."
+    )
+    parser.add_argument("src", help="map to read")
+    parser.add_argument("dst", help=f"map to write; {MAP_EXTENSION} selects binary")
+    args = parser.parse_args()
+
+    if args.dst.endswith(MAP_EXTENSION):
+        json_to_binary(args.src, args.dst, CHUNK_SIZE)
+    else:
+        binary_to_json(args.src, args.dst)
+    print(
+        f"{args.src} ({os.path.getsize(args.src)} bytes) -> {args.dst} "
+        f"({os.path.getsize(args.dst)} bytes)"
+    )
@@ -1,60 +1,312 @@
-# The Particle class is a blueprint for creating particle objects.
-class Particle:
-    def __init__(self, game, particle_type, pos, velocity=[0, 0], frame=0):
-        """
-        The function initializes a particle object with specified attributes.
-
-        :param game: The "game" parameter is an instance of the game class that the particle belongs to.
-        It is used to access game assets and perform game-related operations
-        :param particle_type: The `particle_type` parameter represents the type of particle. It is used
-        to determine the animation for the particle
-        :param pos: The "pos" parameter represents the position of the particle in the game world. It is
-        a list containing the x and y coordinates of the particle's position
-        :param velocity: The velocity parameter is a list representing the initial velocity of the
-        particle in the x and y directions. The default value is [0, 0], which means the particle starts
-        with no initial velocity
-        :param frame: The "frame" parameter is used to specify the initial frame of the particle
-        animation. It determines which frame of the animation will be displayed when the particle is
-        first created, defaults to 0 (optional)
+import numpy as np
+
+# Horizontal sine sway applied to drifting particle types: (amplitude, frequency per frame).
+PARTICLE_SWAY = {"leaf": (0.3, 0.035)}
+
+# What `ParticleSystem` does with new particles once every slot is taken.
+DROP_OLDEST = "drop_oldest"
+REJECT = "reject"
+
+# Stand-in last frame for looping animations, which never finish.
+NEVER = np.iinfo(np.int32).max
+
+
+# The ParticleSystem class simulates every live particle at once in a fixed-capacity pool of
+# NumPy-backed slots, instead of one object per particle.
+class ParticleSystem:
+    def __init__(self, game, capacity=4096, overflow=DROP_OLDEST):
+        """
+        The function initializes an empty particle pool. Every array is allocated here, once; spawning
+        and updating particles reuses free slots instead of allocating new ones.
+
+        :param game: The "game" parameter is an instance of the game class that the particles belong to.
+        It is used to look up the `particle/<type>` animations in the game assets
+        :param capacity: The `capacity` parameter is the maximum number of live particles, defaults to
+        4096 (optional)
+        :param overflow: The `overflow` parameter decides what happens to new particles when the pool
+        is full: DROP_OLDEST frees the oldest live particles to make room, REJECT discards the new
+        ones, defaults to DROP_OLDEST (optional)
         """
+        if overflow not in (DROP_OLDEST, REJECT):
+            raise ValueError(f"unknown particle overflow policy: {overflow!r}")
+
         self.game = game
-        self.type = particle_type
-        self.pos = list(pos)
-        self.velocity = list(velocity)
-        self.frame = frame
-        self.animation = self.game.assets[f"particle/{particle_type}"].copy()
+        self.capacity = capacity
+        self.overflow = overflow
+
+        self.pos = np.zeros((capacity, 2), dtype=np.float64)
+        self.velocity = np.zeros((capacity, 2), dtype=np.float64)
+        self.frame = np.zeros(capacity, dtype=np.int32)
+        self.length = np.ones(capacity, dtype=np.int32)
+        self.last_frame = np.full(capacity, NEVER, dtype=np.int32)
+        self.duration = np.ones(capacity, dtype=np.int32)
+        self.first_image = np.zeros(capacity, dtype=np.int32)
+        self.sway = np.zeros((capacity, 2), dtype=np.float64)
+        self.born = np.zeros(capacity, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.used = np.zeros(capacity, dtype=bool)
+
+        self.free = np.arange(capacity - 1, -1, -1, dtype=np.int32)
+        self.free_count = capacity
+        self.high_water = 0
+        self.next_serial = 0
+
+        self.sway_step = np.zeros(capacity, dtype=np.float64)
+        self.dying = np.zeros(capacity, dtype=bool)
+
+        self.kinds = {}
+        self.images = []
+        self.image_sizes = np.zeros((0, 2), dtype=np.int32)
+
+        self.recycled = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.capacity - self.free_count
+
+    @property
+    def live(self) -> int:
+        """
+        The function returns the number of live particles.
+        :return: the number of occupied slots.
+        """
+        return len(self)
+
+    def kind(self, particle_type) -> tuple:
+        """
+        The function returns the animation table of a particle type, registering its frames the first
+        time the type is used.
+
+        :param particle_type: The `particle_type` parameter is the particle type name, e.g. "leaf". Its
+        animation is read from `game.assets["particle/<type>"]`
+        :return: a `(first_image, duration, length, last_frame, sway)` tuple.
+        """
+        if particle_type not in self.kinds:
+            animation = self.game.assets[f"particle/{particle_type}"]
+            length = animation.image_duration * len(animation.images)
+            self.kinds[particle_type] = (
+                len(self.images),
+                animation.image_duration,
+                length,
+                NEVER if animation.loop else length - 1,
+                PARTICLE_SWAY.get(particle_type, (0.0, 0.0)),
+            )
+            self.images.extend(animation.images)
+            self.image_sizes = np.vstack(
+                (self.image_sizes, [img.get_size() for img in animation.images])
+            )
+        return self.kinds[particle_type]
+
+    def acquire(self, count) -> np.ndarray:
+        """
+        The function takes `count` slots off the free list, applying the overflow policy when there are
+        not enough free slots.
+
+        :param count: The `count` parameter is the number of slots wanted
+        :return: an array of slot indices, possibly shorter than `count`.
+        """
+        if count > self.free_count:
+            missing = count - self.free_count
+            if self.overflow == REJECT:
+                self.dropped += missing
+                count = self.free_count
+            else:
+                if count > self.capacity:
+                    self.dropped += count - self.capacity
+                    count = self.capacity
+                    missing = count - self.free_count
+                self.release(self.oldest(missing))
+                self.dropped += missing
+
+        slots = self.free[self.free_count - count : self.free_count].copy()
+        self.free_count -= count
+        if count:
+            self.recycled += int(np.count_nonzero(self.used[slots]))
+            self.high_water = max(self.high_water, int(slots.max()) + 1)
+        return slots
+
+    def oldest(self, count) -> np.ndarray:
+        """
+        The function finds the `count` live particles that were spawned first.
+
+        :param count: The `count` parameter is the number of particles wanted
+        :return: an array of slot indices.
+        """
+        live_slots = np.flatnonzero(self.alive[: self.high_water])
+        if count >= len(live_slots):
+            return live_slots
+        order = np.argpartition(self.born[live_slots], count - 1)[:count]
+        return live_slots[order]
+
+    def release(self, slots):
+        """
+        The function returns slots to the free list and resets them so the batched update leaves them
+        untouched.
+
+        :param slots: The `slots` parameter is an array of occupied slot indices
+        """
+        count = len(slots)
+        if not count:
+            return
+        self.alive[slots] = False
+        self.velocity[slots] = 0
+        self.sway[slots] = 0
+        self.length[slots] = 1
+        self.last_frame[slots] = NEVER
+        self.free[self.free_count : self.free_count + count] = slots
+        self.free_count += count
+
+        if self.free_count == self.capacity:
+            self.high_water = 0
+        elif not self.alive[self.high_water - 1]:
+            self.high_water = int(np.flatnonzero(self.alive[: self.high_water])[-1]) + 1
+
+    def fill(self, slots, particle_type, pos, velocity, frame):
+        first_image, duration, length, last_frame, sway = self.kind(particle_type)
+        self.pos[slots] = pos
+        self.velocity[slots] = velocity
+        self.frame[slots] = frame
+        self.first_image[slots] = first_image
+        self.duration[slots] = duration
+        self.length[slots] = length
+        self.last_frame[slots] = last_frame
+        self.sway[slots] = sway
+        self.alive[slots] = True
+        self.used[slots] = True
+        self.born[slots] = np.arange(self.next_serial, self.next_serial + len(slots))
+        self.next_serial += len(slots)
+
+    def spawn(self, particle_type, pos, velocity=(0, 0), frame=0):
+        """
+        The function adds one particle.
+
+        :param particle_type: The `particle_type` parameter is the particle type name, e.g. "leaf"
+        :param pos: The "pos" parameter is the (x, y) position of the particle in the game world
+        :param velocity: The velocity parameter is the (x, y) distance the particle moves every frame,
+        defaults to (0, 0) (optional)
+        :param frame: The "frame" parameter is the animation frame the particle starts on, defaults to
+        0 (optional)
+        :return: True if the particle was added, False if the pool rejected it.
+        """
+        slots = self.acquire(1)
+        if not len(slots):
+            return False
+        self.fill(slots, particle_type, pos, velocity, frame)
+        return True
+
+    def spawn_many(self, particle_type, pos, velocity, frame=0):
+        """
+        The function adds a batch of particles of the same type in one step.
+
+        :param particle_type: The `particle_type` parameter is the particle type name, e.g. "particle"
+        :param pos: The "pos" parameter is an (N, 2) array-like of positions, or a single (x, y)
+        position shared by the whole batch
+        :param velocity: The velocity parameter is an (N, 2) array-like of velocities. Its length
+        decides how many particles are spawned
+        :param frame: The "frame" parameter is the animation frame the particles start on, either one
+        value or one per particle, defaults to 0 (optional)
+        :return: the number of particles added.
+        """
+        velocity = np.asarray(velocity, dtype=np.float64).reshape(-1, 2)
+        slots = self.acquire(len(velocity))
+        if len(slots) < len(velocity):
+            keep = slice(len(velocity) - len(slots), None)
+            velocity = velocity[keep]
+            if np.ndim(pos) == 2:
+                pos = np.asarray(pos)[keep]
+            if np.ndim(frame) == 1:
+                frame = np.asarray(frame)[keep]
+        if len(slots):
+            self.fill(slots, particle_type, pos, velocity, frame)
+        return len(slots)
 
     def update(self):
         """
-        The function updates the position and animation of an object and returns a boolean value
-        indicating if the animation is done.
-        :return: the value of the variable "kill".
+        The function advances every particle by one frame: it frees particles whose animation finished
+        on the previous frame, moves the rest by their velocity, steps their animation and applies the
+        sine sway of drifting types. It works in place on the preallocated slot arrays.
         """
-        kill = bool(self.animation.done)
+        n = self.high_water
+        if not n:
+            return
 
-        self.pos[0] += self.velocity[0]
-        self.pos[1] += self.velocity[1]
+        dying = self.dying[:n]
+        np.greater_equal(self.frame[:n], self.last_frame[:n], out=dying)
+        if dying.any():
+            self.release(np.flatnonzero(dying))
+            n = self.high_water
 
-        self.animation.update()
+        pos = self.pos[:n]
+        frame = self.frame[:n]
+        np.add(pos, self.velocity[:n], out=pos)
+        np.add(frame, 1, out=frame)
+        np.remainder(frame, self.length[:n], out=frame)
 
-        return kill
+        step = self.sway_step[:n]
+        np.multiply(frame, self.sway[:n, 1], out=step)
+        np.sin(step, out=step)
+        np.multiply(step, self.sway[:n, 0], out=step)
+        np.add(pos[:, 0], step, out=pos[:, 0])
+
+    def in_rect(self, rect) -> np.ndarray:
+        """
+        The function finds the live particles whose position lies inside `rect`, testing every live
+        slot in one vectorized step. Particles move every tick, so this beats keeping them in a
+        spatial hash.
+
+        :param rect: The `rect` parameter is a pygame.Rect in world pixels
+        :return: an array of slot indices, usable with `pos`, `velocity` or `release`.
+        """
+        n = self.high_water
+        pos = self.pos[:n]
+        inside = (
+            self.alive[:n]
+            & (pos[:, 0] >= rect.left)
+            & (pos[:, 0] < rect.right)
+            & (pos[:, 1] >= rect.top)
+            & (pos[:, 1] < rect.bottom)
+        )
+        return np.flatnonzero(inside)
 
     def render(self, surf, offset=(0, 0)):
         """
-        The `render` function takes a surface and an offset as parameters, and blits the animation image
-        onto the surface at a position calculated based on the object's position and the offset.
+        The `render` function draws every live particle centered on its position with a single
+        `Surface.blits` call.
 
-        :param surf: The `surf` parameter is the surface on which the image will be rendered. It is the
-        surface where the image will be blitted onto
+        :param surf: The `surf` parameter is the surface on which the particles will be rendered
         :param offset: The `offset` parameter is a tuple that represents the x and y offsets for
-        positioning the image on the surface (`surf`). It is used to adjust the position of the image
-        relative to the surface. By default, the offset is set to (0, 0), which means the image will be
-        """
-        img = self.animation.img()
-        surf.blit(
-            self.animation.img(),
-            (
-                self.pos[0] - offset[0] - img.get_width() // 2,
-                self.pos[1] - offset[1] - img.get_width() // 2,
-            ),
+        positioning the images on the surface (`surf`), i.e. the camera scroll, defaults to (0, 0)
+        (optional)
+        """
+        surf.blits(self.draw_list(surf.get_size(), offset=offset), doreturn=False)
+
+    def draw_list(self, size, offset=(0, 0)) -> list:
+        """
+        The function returns the current image and screen position of every live particle.
+
+        :param size: The `size` parameter is the (width, height) of the surface the particles are drawn
+        on
+        :param offset: The `offset` parameter is the camera scroll, defaults to (0, 0) (optional)
+        :return: a list of `(img, pos)` pairs.
+        """
+        images, _, image_index, positions = self.draw_arrays(offset=offset)
+        return list(zip([images[i] for i in image_index.tolist()], positions.tolist()))
+
+    def draw_arrays(self, offset=(0, 0)) -> tuple:
+        """
+        The function returns the draw data of every live particle as arrays, in the form taken by
+        `RenderQueue.extend_arrays`.
+
+        :param offset: The `offset` parameter is the camera scroll, defaults to (0, 0) (optional)
+        :return: an `(images, sizes, image_index, positions)` tuple, where `image_index` selects a
+        surface from `images` for each particle and `positions` holds their screen positions.
+        """
+        slots = np.flatnonzero(self.alive[: self.high_water])
+        image_index = (
+            self.first_image[slots] + self.frame[slots] // self.duration[slots]
+        )
+        # Particles are centered on their position, using the image width on both axes.
+        positions = (
+            self.pos[slots] - offset - (self.image_sizes[image_index, 0] // 2)[:, None]
         )
+        return self.images, self.image_sizes, image_index, positions
@@ -0,0 +1,237 @@
+import csv
+import json
+import time
+import pygame
+from collections import deque
+from contextlib import nullcontext
+
+# Shared do-nothing scope returned while profiling is disabled.
+NULL_SCOPE = nullcontext()
+
+# Number of recent frames the rolling statistics cover.
+PROFILER_WINDOW = 600
+PERCENTILES = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+
+# The Scope class times one named block and adds the elapsed time to the current frame.
+class Scope:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        frame_times = self.profiler.frame_times
+        frame_times[self.name] = (
+            frame_times.get(self.name, 0.0) + time.perf_counter() - self.start
+        )
+        return False
+
+
+def percentiles(samples, scale=1.0) -> dict:
+    """
+    The function summarizes a list of samples.
+
+    :param samples: The `samples` parameter is a non-empty iterable of numbers
+    :param scale: The `scale` parameter multiplies every statistic, e.g. 1000 to turn seconds into
+    milliseconds, defaults to 1.0 (optional)
+    :return: a dictionary with the mean, the PERCENTILES and the maximum.
+    """
+    ordered = sorted(samples)
+    report = {"mean": sum(ordered) / len(ordered) * scale}
+    for key, fraction in PERCENTILES.items():
+        report[key] = (
+            ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * scale
+        )
+    report["max"] = ordered[-1] * scale
+    return report
+
+
+# The Profiler class collects per-frame timings of named scopes and per-frame counters, and keeps
+# rolling statistics over the last `window` frames.
+class Profiler:
+    def __init__(self, enabled=False, window=PROFILER_WINDOW):
+        """
+        The function initializes a profiler.
+
+        :param enabled: The `enabled` parameter turns timing on. While it is off, `scope` returns a
+        shared no-op context manager and `count` returns at once, defaults to False (optional)
+        :param window: The `window` parameter is the number of recent frames kept for the statistics,
+        or None to keep every frame, defaults to PROFILER_WINDOW (optional)
+        """
+        self.enabled = enabled
+        self.window = window
+        self.frame_times = {}
+        self.frame_counts = {}
+        self.history = {}
+        self.count_history = {}
+        self.frames = 0
+
+    def scope(self, name):
+        """
+        The function returns a context manager that times the block it wraps under `name`. Several
+        blocks with the same name in one frame add up.
+
+        :param name: The `name` parameter is the scope name, e.g. "particles.update"
+        :return: a context manager.
+        """
+        if not self.enabled:
+            return NULL_SCOPE
+        return Scope(self, name)
+
+    def count(self, name, value=1):
+        """
+        The function adds `value` to the counter `name` of the current frame, e.g. the number of blits
+        or of live particles.
+
+        :param name: The `name` parameter is the counter name
+        :param value: The `value` parameter is the amount to add, defaults to 1 (optional)
+        """
+        if self.enabled:
+            self.frame_counts[name] = self.frame_counts.get(name, 0) + value
+
+    def end_frame(self):
+        """
+        The function closes the current frame, storing the total time of every scope and the value of
+        every counter seen in it.
+        """
+        if not self.enabled:
+            return
+        for history, frame_values in (
+            (self.history, self.frame_times),
+            (self.count_history, self.frame_counts),
+        ):
+            for name, value in frame_values.items():
+                if name not in history:
+                    history[name] = deque(maxlen=self.window)
+                history[name].append(value)
+        self.frame_times = {}
+        self.frame_counts = {}
+        self.frames += 1
+
+    def reset(self):
+        """
+        The function forgets every recorded frame.
+        """
+        self.frame_times = {}
+        self.frame_counts = {}
+        self.history = {}
+        self.count_history = {}
+        self.frames = 0
+
+    def summary(self) -> dict:
+        """
+        The function summarizes the recorded frames.
+        :return: a dictionary mapping scope names to mean, median, 95th and 99th percentile and maximum
+        times in milliseconds.
+        """
+        return {
+            name: percentiles(samples, 1000)
+            for name, samples in sorted(self.history.items())
+        }
+
+    def count_summary(self) -> dict:
+        """
+        The function summarizes the recorded counters.
+        :return: a dictionary mapping counter names to mean, median, 95th and 99th percentile and
+        maximum values.
+        """
+        return {
+            name: percentiles(samples)
+            for name, samples in sorted(self.count_history.items())
+        }
+
+    def export(self, path):
+        """
+        The function writes the current statistics to a file. A ".csv" path gets one row per scope or
+        counter; any other path gets JSON.
+
+        :param path: The `path` parameter is the file to write
+        """
+        timings, counts = self.summary(), self.count_summary()
+        if path.endswith(".csv"):
+            columns = ["mean", *PERCENTILES, "max"]
+            with open(path, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(["name", "unit", *columns])
+                for unit, stats in (("ms", timings), ("count", counts)):
+                    for name, row in stats.items():
+                        writer.writerow([name, unit, *(row[key] for key in columns)])
+        else:
+            with open(path, "w") as f:
+                json.dump(
+                    {"frames": self.frames, "timings_ms": timings, "counts": counts},
+                    f,
+                    indent=2,
+                )
+
+
+# The ProfilerOverlay class draws a profiler's rolling statistics in a corner of a surface.
+class ProfilerOverlay:
+    def __init__(self, profiler, font_size=16, refresh=30):
+        """
+        The function initializes an overlay.
+
+        :param profiler: The `profiler` parameter is the Profiler to show
+        :param font_size: The `font_size` parameter is the text size in pixels, defaults to 16
+        (optional)
+        :param refresh: The `refresh` parameter is the number of frames between two redraws of the
+        text, which is cached in between, defaults to 30 (optional)
+        """
+        self.profiler = profiler
+        self.refresh = refresh
+        self.font = pygame.font.Font(None, font_size)
+        self.panel = None
+        self.drawn_at = None
+
+    def rows(self) -> list:
+        """
+        The function formats the profiler's statistics as table rows.
+        :return: a list of rows, each a list of cell strings.
+        """
+        rows = [["scope (ms)", "p50", "p95", "p99"]]
+        for name, row in self.profiler.summary().items():
+            rows.append([name, *(f"{row[key]:.2f}" for key in PERCENTILES)])
+        rows.append(["counter", "p50", "max", ""])
+        for name, row in self.profiler.count_summary().items():
+            rows.append([name, f"{row['p50']:.0f}", f"{row['max']:.0f}", ""])
+        return rows
+
+    def render(self, surf, pos=(8, 8)):
+        """
+        The function draws the overlay onto `surf`, redrawing its text every `refresh` frames.
+
+        :param surf: The `surf` parameter is the surface to draw on, typically the window
+        :param pos: The `pos` parameter is the top-left corner of the overlay, defaults to (8, 8)
+        (optional)
+        """
+        frames = self.profiler.frames
+        if self.panel is None or frames - self.drawn_at >= self.refresh:
+            cells = [
+                [self.font.render(text, True, (255, 255, 255)) for text in row]
+                for row in self.rows()
+            ]
+            widths = [
+                max(cell.get_width() for cell in column) for column in zip(*cells)
+            ]
+            line_height = self.font.get_linesize()
+            self.panel = pygame.Surface(
+                (sum(widths) + 12 * len(widths), line_height * len(cells) + 8),
+                pygame.SRCALPHA,
+            )
+            self.panel.fill((0, 0, 0, 160))
+            blits = []
+            for i, row in enumerate(cells):
+                x = 4
+                for j, cell in enumerate(row):
+                    # Names are left-aligned, numbers right-aligned.
+                    offset = 0 if j == 0 else widths[j] - cell.get_width()
+                    blits.append((cell, (x + offset, 4 + i * line_height)))
+                    x += widths[j] + 12
+            self.panel.blits(blits, doreturn=False)
+            self.drawn_at = frames
+        surf.blit(self.panel, pos)
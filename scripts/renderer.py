@@ -0,0 +1,233 @@
+import numpy as np
+import pygame
+from scripts.profiler import NULL_SCOPE
+
+# Draw layers, back to front.
+LAYER_BACKGROUND = 0
+LAYER_CLOUDS = 1
+LAYER_TILES = 2
+LAYER_ENTITIES = 3
+LAYER_PARTICLES = 4
+
+# How `Presenter` brings the render surface to the window: nearest-neighbour or smooth software
+# scaling into the window surface, or SDL's SCALED mode, which scales on the GPU.
+SCALE_NEAREST = "nearest"
+SCALE_SMOOTH = "smooth"
+SCALE_HARDWARE = "hardware"
+SCALE_MODES = (SCALE_NEAREST, SCALE_SMOOTH, SCALE_HARDWARE)
+
+LAYER_NAMES = {
+    LAYER_BACKGROUND: "background",
+    LAYER_CLOUDS: "clouds",
+    LAYER_TILES: "tiles",
+    LAYER_ENTITIES: "entities",
+    LAYER_PARTICLES: "particles",
+}
+
+
+# The RenderQueue class collects the sprites of one frame by layer, culls the ones outside the camera
+# and draws each layer with a single Surface.blits call.
+class RenderQueue:
+    def __init__(self, size, profiler=None):
+        """
+        The function initializes an empty queue for a target surface of the given size.
+
+        :param size: The `size` parameter is the (width, height) of the surface the queue is flushed
+        to. Queued positions are in screen space, so the camera rect (the scroll offset plus this size)
+        maps to the rect from (0, 0) to `size`, and anything outside it is culled
+        :param profiler: The `profiler` parameter is a `scripts.profiler.Profiler` that times the
+        drawing of each layer under "<layer name>.draw", defaults to None (optional)
+        """
+        self.size = tuple(size)
+        self.profiler = profiler
+        self.layers = {}
+        self.draw_counts = {}
+        self.cull_counts = {}
+        self.culled = {}
+
+    def visible(self, img, pos) -> bool:
+        """
+        The function tells whether an image drawn at `pos` overlaps the camera.
+
+        :param img: The `img` parameter is the pygame.Surface to draw
+        :param pos: The `pos` parameter is the screen position of the image's top-left corner
+        :return: True if any part of the image is on screen.
+        """
+        return (
+            pos[0] < self.size[0]
+            and pos[1] < self.size[1]
+            and pos[0] + img.get_width() > 0
+            and pos[1] + img.get_height() > 0
+        )
+
+    def submit(self, img, pos, layer):
+        """
+        The function queues one image, unless it is entirely off screen.
+
+        :param img: The `img` parameter is the pygame.Surface to draw
+        :param pos: The `pos` parameter is the screen position of the image's top-left corner
+        :param layer: The `layer` parameter is the layer to draw the image in, e.g. LAYER_ENTITIES
+        """
+        if self.visible(img, pos):
+            self.layers.setdefault(layer, []).append((img, pos))
+        else:
+            self.culled[layer] = self.culled.get(layer, 0) + 1
+
+    def extend(self, items, layer):
+        """
+        The function queues a batch of images, skipping the ones that are entirely off screen.
+
+        :param items: The `items` parameter is an iterable of `(img, pos)` pairs, such as the
+        `draw_list` of a subsystem
+        :param layer: The `layer` parameter is the layer to draw the images in
+        """
+        queued = self.layers.setdefault(layer, [])
+        before = len(queued)
+        total = 0
+        for item in items:
+            total += 1
+            if self.visible(*item):
+                queued.append(item)
+        self.culled[layer] = self.culled.get(layer, 0) + total - (len(queued) - before)
+
+    def extend_arrays(self, images, sizes, image_index, positions, layer):
+        """
+        The function queues a batch of images described by arrays, culling off-screen ones in one
+        vectorized step before any per-image Python objects are built.
+
+        :param images: The `images` parameter is the list of surfaces that `image_index` refers to
+        :param sizes: The `sizes` parameter is an (len(images), 2) array with the size of each image
+        :param image_index: The `image_index` parameter is an (N,) array of indices into `images`
+        :param positions: The `positions` parameter is an (N, 2) array of screen positions
+        :param layer: The `layer` parameter is the layer to draw the images in
+        """
+        extent = sizes[image_index]
+        on_screen = (
+            (positions[:, 0] < self.size[0])
+            & (positions[:, 1] < self.size[1])
+            & (positions[:, 0] + extent[:, 0] > 0)
+            & (positions[:, 1] + extent[:, 1] > 0)
+        )
+        visible = int(np.count_nonzero(on_screen))
+        self.culled[layer] = self.culled.get(layer, 0) + len(on_screen) - visible
+        if visible:
+            self.layers.setdefault(layer, []).extend(
+                zip(
+                    [images[i] for i in image_index[on_screen].tolist()],
+                    positions[on_screen].tolist(),
+                )
+            )
+
+    def flush(self, surf):
+        """
+        The function draws every queued layer onto `surf`, lowest layer first, records how many images
+        each layer drew and culled, and empties the queue.
+
+        :param surf: The `surf` parameter is the surface to draw onto
+        """
+        self.draw_counts = {}
+        for layer in sorted(self.layers):
+            items = self.layers[layer]
+            scope = (
+                self.profiler.scope(LAYER_NAMES.get(layer, str(layer)) + ".draw")
+                if self.profiler is not None
+                else NULL_SCOPE
+            )
+            with scope:
+                surf.blits(items, doreturn=False)
+            self.draw_counts[layer] = len(items)
+            items.clear()
+        self.cull_counts = self.culled
+        self.culled = {}
+
+    @property
+    def total_culled(self) -> int:
+        """
+        The function returns how many images the last flushed frame culled across all layers.
+        :return: the number of culled images.
+        """
+        return sum(self.cull_counts.values())
+
+    def report(self) -> dict:
+        """
+        The function returns the draw and cull counts of the last flush keyed by layer name.
+        :return: a dictionary mapping layer names to `{"drawn": n, "culled": n}` dictionaries.
+        """
+        return {
+            LAYER_NAMES.get(layer, str(layer)): {
+                "drawn": self.draw_counts.get(layer, 0),
+                "culled": self.cull_counts.get(layer, 0),
+            }
+            for layer in sorted(set(self.draw_counts) | set(self.cull_counts))
+        }
+
+
+# The Presenter class owns the window and the low-resolution surface frames are rendered to, and
+# scales one onto the other without allocating a new surface every frame.
+class Presenter:
+    def __init__(self, window_size, render_size, scaling=SCALE_NEAREST, headless=False):
+        """
+        The function opens the window and creates the render surface.
+
+        :param window_size: The `window_size` parameter is the (width, height) of the window
+        :param render_size: The `render_size` parameter is the (width, height) frames are rendered at
+        :param scaling: The `scaling` parameter is one of SCALE_MODES. SCALE_NEAREST and SCALE_SMOOTH
+        scale each frame in software straight into the window surface; SCALE_HARDWARE opens the window
+        in SDL's SCALED mode at the render size, so frames are drawn to the window surface itself and
+        scaled on presentation, defaults to SCALE_NEAREST (optional)
+        :param headless: The `headless` parameter presents into an off-screen surface of `window_size`
+        instead of a window, scaling in software, defaults to False (optional)
+        """
+        if scaling not in SCALE_MODES:
+            raise ValueError(f"unknown scaling mode: {scaling!r}")
+
+        self.headless = headless
+        self.scaling = scaling
+        render_size = (int(render_size[0]), int(render_size[1]))
+        if headless:
+            pygame.display.set_mode((1, 1))
+            self.screen = pygame.Surface(window_size)
+            self.display = pygame.Surface(render_size)
+        elif scaling == SCALE_HARDWARE:
+            self.screen = pygame.display.set_mode(render_size, pygame.SCALED)
+            self.display = self.screen
+        else:
+            self.screen = pygame.display.set_mode(window_size)
+            self.display = pygame.Surface(render_size)
+
+    def to_render(self, pos) -> tuple:
+        """
+        The function maps a window position, such as the mouse position, to the render surface.
+
+        :param pos: The `pos` parameter is an (x, y) position in window pixels. In SCALE_HARDWARE mode
+        SDL already reports positions in render pixels
+        :return: the (x, y) position in render pixels.
+        """
+        if self.display is self.screen:
+            return pos
+        return (
+            pos[0] * self.display.get_width() / self.screen.get_width(),
+            pos[1] * self.display.get_height() / self.screen.get_height(),
+        )
+
+    def present(self):
+        """
+        The function scales the render surface into the window surface, reusing the window surface as
+        the scaling target. It does nothing in SCALE_HARDWARE mode, where they are the same surface.
+        """
+        if self.display is self.screen:
+            return
+        size = self.screen.get_size()
+        if self.display.get_size() == size:
+            self.screen.blit(self.display, (0, 0))
+        elif self.scaling == SCALE_SMOOTH:
+            pygame.transform.smoothscale(self.display, size, self.screen)
+        else:
+            pygame.transform.scale(self.display, size, self.screen)
+
+    def flip(self):
+        """
+        The function shows the window surface on screen.
+        """
+        if not self.headless:
+            pygame.display.update()
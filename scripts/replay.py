@@ -0,0 +1,294 @@
+import struct
+import zlib
+import pygame
+from array import array
+
+REPLAY_MAGIC = b"GMRP"
+REPLAY_VERSION = 2
+# Actions that can be recorded, in the order of their codes in a replay file.
+REPLAY_ACTIONS = ("left", "right", "jump", "dash")
+
+# magic, version, seed, render width, render height, stream radius (-1 when the map was not
+# streamed), map path length
+HEADER_FORMAT = "<4sHqHHhH"
+INPUT_FORMAT = "<IB"
+
+
+def physics_checksum(game) -> int:
+    """
+    The function hashes the simulation state that physics and spawning decide: the player's position,
+    velocity and movement state, the camera scroll, the other entities and every live particle. Two
+    runs that stay in step produce the same checksum on every tick.
+
+    :param game: The `game` parameter is the Game instance to hash
+    :return: a 32-bit CRC.
+    """
+    player = game.player
+    state = struct.pack(
+        "<6d5i",
+        player.pos[0],
+        player.pos[1],
+        player.velocity[0],
+        player.velocity[1],
+        game.scroll[0],
+        game.scroll[1],
+        player.air_time,
+        player.jumps,
+        player.dashing,
+        player.flip,
+        len(game.particles),
+    )
+    particles = game.particles
+    checksum = zlib.crc32(state)
+    for entity in game.entities:
+        checksum = zlib.crc32(
+            struct.pack("<4d", *entity.pos, *entity.velocity), checksum
+        )
+    checksum = zlib.crc32(particles.pos[: particles.high_water].tobytes(), checksum)
+    return zlib.crc32(particles.alive[: particles.high_water].tobytes(), checksum)
+
+
+# The Replay class holds a recorded run: the seed and map it started from, the inputs with the tick
+# they were applied before, and the physics checksum after every tick.
+class Replay:
+    def __init__(
+        self,
+        seed,
+        map_path,
+        inputs=None,
+        checksums=None,
+        render_size=None,
+        stream_radius=None,
+    ):
+        """
+        The function initializes a replay.
+
+        :param seed: The `seed` parameter is the seed of the recorded game's random number generator
+        :param map_path: The `map_path` parameter is the map the recorded game loaded
+        :param inputs: The `inputs` parameter is a list of `(tick, action, pressed)` tuples, in the
+        order they were applied, defaults to an empty list (optional)
+        :param checksums: The `checksums` parameter is an array of `physics_checksum` values, one per
+        tick, defaults to an empty array (optional)
+        :param render_size: The `render_size` parameter is the (width, height) the recorded game
+        rendered at, which decides its camera and which entities are awake, defaults to None
+        (optional)
+        :param stream_radius: The `stream_radius` parameter is the recorded game's `stream_radius`,
+        defaults to None (optional)
+        """
+        self.seed = seed
+        self.map_path = map_path
+        self.inputs = inputs if inputs is not None else []
+        self.checksums = checksums if checksums is not None else array("I")
+        self.render_size = tuple(render_size) if render_size is not None else None
+        self.stream_radius = stream_radius
+
+    def __len__(self):
+        return len(self.checksums)
+
+    def save(self, path):
+        """
+        The function writes the replay to a compact binary file: a header with the seed, render size,
+        stream radius and map path, five bytes per input and four bytes per tick checksum.
+
+        :param path: The `path` parameter is the file to write
+        """
+        map_path = self.map_path.encode("utf-8")
+        width, height = self.render_size or (0, 0)
+        with open(path, "wb") as f:
+            f.write(
+                struct.pack(
+                    HEADER_FORMAT,
+                    REPLAY_MAGIC,
+                    REPLAY_VERSION,
+                    self.seed,
+                    width,
+                    height,
+                    -1 if self.stream_radius is None else self.stream_radius,
+                    len(map_path),
+                )
+            )
+            f.write(map_path)
+            f.write(struct.pack("<I", len(self.inputs)))
+            for tick, action, pressed in self.inputs:
+                code = REPLAY_ACTIONS.index(action) << 1 | bool(pressed)
+                f.write(struct.pack(INPUT_FORMAT, tick, code))
+            f.write(struct.pack("<I", len(self.checksums)))
+            f.write(struct.pack(f"<{len(self.checksums)}I", *self.checksums))
+
+    @classmethod
+    def load(cls, path):
+        """
+        The function reads a replay written by `save`.
+
+        :param path: The `path` parameter is the file to read
+        :return: a Replay.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+
+        magic, version = struct.unpack_from("<4sH", data)
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(f"{path} is not a version {REPLAY_VERSION} replay file")
+        _, _, seed, width, height, stream_radius, map_length = struct.unpack_from(
+            HEADER_FORMAT, data
+        )
+        offset = struct.calcsize(HEADER_FORMAT)
+        map_path = data[offset : offset + map_length].decode("utf-8")
+        offset += map_length
+
+        (input_count,) = struct.unpack_from("<I", data, offset)
+        offset += 4
+        inputs = []
+        for tick, code in struct.iter_unpack(
+            INPUT_FORMAT,
+            data[offset : offset + input_count * struct.calcsize(INPUT_FORMAT)],
+        ):
+            inputs.append((tick, REPLAY_ACTIONS[code >> 1], bool(code & 1)))
+        offset += input_count * struct.calcsize(INPUT_FORMAT)
+
+        (tick_count,) = struct.unpack_from("<I", data, offset)
+        checksums = array("I", struct.unpack_from(f"<{tick_count}I", data, offset + 4))
+        return cls(
+            seed,
+            map_path,
+            inputs,
+            checksums,
+            render_size=(width, height) if width and height else None,
+            stream_radius=None if stream_radius < 0 else stream_radius,
+        )
+
+
+# The InputRecorder class records the inputs applied to a game and its physics checksum after every
+# tick, so the run can be saved as a Replay.
+class InputRecorder:
+    def __init__(self, game, path=None):
+        """
+        The function initializes a recorder for `game` and attaches it, so `Game.apply_input` and
+        `Game.step` report to it.
+
+        :param game: The `game` parameter is the Game instance to record. It should not have stepped
+        yet, so the replay starts from the seeded initial state
+        :param path: The `path` parameter is the file `save` writes to, defaults to None (optional)
+        """
+        self.game = game
+        self.path = path
+        self.replay = Replay(
+            game.seed,
+            game.map_path,
+            render_size=game.display.get_size(),
+            stream_radius=game.stream_radius,
+        )
+        game.recorder = self
+
+    def record_input(self, tick, action, pressed):
+        """
+        The function records one input.
+
+        :param tick: The `tick` parameter is the number of ticks simulated before the input was applied
+        :param action: The `action` parameter is one of REPLAY_ACTIONS
+        :param pressed: The `pressed` parameter is True for a key press and False for a release
+        """
+        self.replay.inputs.append((tick, action, pressed))
+
+    def record_tick(self):
+        """
+        The function records the physics checksum of the tick that just finished.
+        """
+        self.replay.checksums.append(physics_checksum(self.game))
+
+    def save(self, path=None):
+        """
+        The function writes the recording.
+
+        :param path: The `path` parameter is the file to write, defaults to the recorder's `path`
+        (optional)
+        """
+        self.replay.save(path or self.path)
+
+
+# The ReplayDriver class feeds a recorded run back into a game one tick at a time and checks every
+# tick's physics checksum against the recording.
+class ReplayDriver:
+    def __init__(self, game, replay):
+        """
+        The function initializes a driver.
+
+        :param game: The `game` parameter is a Game created with the replay's seed, map, render size and
+        stream radius, e.g. `Game(seed=replay.seed, map_path=replay.map_path,
+        render_size=replay.render_size, stream_radius=replay.stream_radius)`, that has not stepped yet
+        :param replay: The `replay` parameter is the Replay to play back
+        """
+        if game.seed != replay.seed:
+            raise ValueError(
+                f"game seed {game.seed} does not match replay seed {replay.seed}"
+            )
+        if (
+            replay.render_size is not None
+            and game.display.get_size() != replay.render_size
+        ):
+            raise ValueError(
+                f"game renders at {game.display.get_size()}, replay at {replay.render_size}"
+            )
+        if game.stream_radius != replay.stream_radius:
+            raise ValueError(
+                f"game stream radius {game.stream_radius} does not match replay stream radius "
+                f"{replay.stream_radius}"
+            )
+        self.game = game
+        self.replay = replay
+        self.next_input = 0
+        self.divergence = None
+
+    @property
+    def done(self) -> bool:
+        """
+        The function tells whether every recorded tick has been played.
+        :return: True once the game has caught up with the recording.
+        """
+        return self.game.tick >= len(self.replay)
+
+    def step(self) -> bool:
+        """
+        The function applies the inputs recorded before the game's next tick, steps the game once and
+        compares the new physics checksum with the recorded one. The first mismatch is stored in
+        `divergence`.
+
+        :return: True if the tick matched the recording.
+        """
+        game = self.game
+        inputs = self.replay.inputs
+        while self.next_input < len(inputs) and inputs[self.next_input][0] <= game.tick:
+            _, action, pressed = inputs[self.next_input]
+            game.apply_input(action, pressed)
+            self.next_input += 1
+
+        tick = game.tick
+        game.step()
+        matched = physics_checksum(game) == self.replay.checksums[tick]
+        if not matched and self.divergence is None:
+            self.divergence = tick
+        return matched
+
+    def run(self, render=False, stop_on_divergence=True):
+        """
+        The function plays the whole recording.
+
+        :param render: The `render` parameter draws every tick. Outside headless mode it also paces
+        playback at the game's TICK_RATE and stops when the window is closed, defaults to False
+        (optional)
+        :param stop_on_divergence: The `stop_on_divergence` parameter stops at the first tick that does
+        not match the recording, defaults to True (optional)
+        :return: the first divergent tick, or None if the whole run matched.
+        """
+        game = self.game
+        while not self.done:
+            if not self.step() and stop_on_divergence:
+                break
+            if render:
+                game.render()
+                if not game.headless:
+                    if pygame.event.peek(pygame.QUIT):
+                        break
+                    pygame.event.pump()
+                    game.clock.tick(game.TICK_RATE)
+        return self.divergence
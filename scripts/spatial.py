@@ -0,0 +1,196 @@
+import math
+import pygame
+
+
+# The SpatialHash class is a uniform grid that buckets items by the cells their bounds overlap.
+class SpatialHash:
+    def __init__(self, cell_size=128):
+        """
+        The function initializes an empty spatial hash.
+
+        :param cell_size: The `cell_size` parameter is the width and height of one grid cell in pixels.
+        Items are bucketed into every cell their rect overlaps, defaults to 128 (optional)
+        """
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = {}
+        self.next_order = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        """
+        The function iterates over the stored items in the order they were inserted.
+        """
+        for entry in self.entries.values():
+            yield entry[0]
+
+    def __contains__(self, item):
+        return id(item) in self.entries
+
+    def cell_range(self, rect):
+        """
+        The function returns the range of cells overlapped by `rect`.
+
+        :param rect: The `rect` parameter is a pygame.Rect in world pixels
+        :return: a tuple `(x0, y0, x1, y1)` of inclusive cell coordinates.
+        """
+        return (
+            rect.left // self.cell_size,
+            rect.top // self.cell_size,
+            (rect.left + max(rect.width, 1) - 1) // self.cell_size,
+            (rect.top + max(rect.height, 1) - 1) // self.cell_size,
+        )
+
+    def insert(self, item, rect):
+        """
+        The function adds `item` with the bounds `rect`.
+
+        :param item: The `item` parameter is the object to store. Items are identified by identity, so
+        unhashable objects such as tile dictionaries can be stored
+        :param rect: The `rect` parameter is a pygame.Rect with the item's bounds in world pixels
+        """
+        rect = pygame.Rect(rect)
+        cells = self.cell_range(rect)
+        self.entries[id(item)] = [item, rect, cells, self.next_order]
+        self.next_order += 1
+        self.link(id(item), item, cells)
+
+    def remove(self, item):
+        """
+        The function removes `item` from the hash.
+
+        :param item: The `item` parameter is an object previously passed to `insert`
+        :return: True if the item was stored, False otherwise.
+        """
+        entry = self.entries.pop(id(item), None)
+        if entry is None:
+            return False
+        self.unlink(id(item), entry[2])
+        return True
+
+    def move(self, item, rect):
+        """
+        The function updates the bounds of a stored item, only touching the buckets when the set of
+        overlapped cells changes.
+
+        :param item: The `item` parameter is an object previously passed to `insert`
+        :param rect: The `rect` parameter is the item's new bounds in world pixels
+        """
+        entry = self.entries[id(item)]
+        entry[1].update(rect)
+        cells = self.cell_range(entry[1])
+        if cells != entry[2]:
+            self.unlink(id(item), entry[2])
+            self.link(id(item), item, cells)
+            entry[2] = cells
+
+    def link(self, key, item, cells):
+        for cx in range(cells[0], cells[2] + 1):
+            for cy in range(cells[1], cells[3] + 1):
+                self.cells.setdefault((cx, cy), {})[key] = item
+
+    def unlink(self, key, cells):
+        for cx in range(cells[0], cells[2] + 1):
+            for cy in range(cells[1], cells[3] + 1):
+                bucket = self.cells[(cx, cy)]
+                del bucket[key]
+                if not bucket:
+                    del self.cells[(cx, cy)]
+
+    def query_rect(self, rect) -> list:
+        """
+        The function returns the items whose bounds overlap `rect`.
+
+        :param rect: The `rect` parameter is the query area in world pixels
+        :return: a list of items, in insertion order.
+        """
+        rect = pygame.Rect(rect)
+        x0, y0, x1, y1 = self.cell_range(rect)
+        found = {}
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                bucket = self.cells.get((cx, cy))
+                if bucket:
+                    for key in bucket:
+                        if key not in found:
+                            entry = self.entries[key]
+                            if rect.colliderect(entry[1]):
+                                found[key] = entry
+        return [entry[0] for entry in sorted(found.values(), key=lambda e: e[3])]
+
+    def query_radius(self, center, radius) -> list:
+        """
+        The function returns the items whose bounds come within `radius` of the point `center`.
+
+        :param center: The `center` parameter is an (x, y) point in world pixels
+        :param radius: The `radius` parameter is the query distance in pixels
+        :return: a list of items, in insertion order.
+        """
+        x, y = center
+        radius_sq = radius * radius
+        items = []
+        for item in self.query_rect(
+            pygame.Rect(
+                math.floor(x - radius),
+                math.floor(y - radius),
+                math.ceil(2 * radius) + 1,
+                math.ceil(2 * radius) + 1,
+            )
+        ):
+            rect = self.entries[id(item)][1]
+            dx = max(rect.left - x, 0, x - rect.right)
+            dy = max(rect.top - y, 0, y - rect.bottom)
+            if dx * dx + dy * dy <= radius_sq:
+                items.append(item)
+        return items
+
+    def pairs(self) -> list:
+        """
+        The function returns every pair of stored items whose bounds overlap, checking only items that
+        share a cell.
+
+        :return: a list of `(a, b)` tuples, `a` inserted before `b`, each pair listed once.
+        """
+        seen = set()
+        found = []
+        for bucket in self.cells.values():
+            if len(bucket) < 2:
+                continue
+            entries = sorted((self.entries[key] for key in bucket), key=lambda e: e[3])
+            for i, a in enumerate(entries):
+                for b in entries[i + 1 :]:
+                    key = (a[3], b[3])
+                    if key not in seen and a[1].colliderect(b[1]):
+                        seen.add(key)
+                        found.append((a[3], b[3], a[0], b[0]))
+        found.sort(key=lambda pair: pair[:2])
+        return [(a, b) for _, _, a, b in found]
+
+    def query_point(self, pos) -> list:
+        """
+        The function returns the items whose bounds contain the point `pos`.
+
+        :param pos: The `pos` parameter is an (x, y) point in world pixels
+        :return: a list of items, in insertion order.
+        """
+        x, y = math.floor(pos[0]), math.floor(pos[1])
+        bucket = self.cells.get((x // self.cell_size, y // self.cell_size))
+        if not bucket:
+            return []
+        entries = [
+            self.entries[key]
+            for key in bucket
+            if self.entries[key][1].collidepoint(x, y)
+        ]
+        return [entry[0] for entry in sorted(entries, key=lambda e: e[3])]
+
+    def rect(self, item):
+        """
+        The function returns the stored bounds of `item`.
+
+        :param item: The `item` parameter is an object previously passed to `insert`
+        :return: a pygame.Rect.
+        """
+        return self.entries[id(item)][1]
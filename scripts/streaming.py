@@ -0,0 +1,197 @@
+import queue
+import threading
+from scripts.tilemap import TileChunk, CHUNK_SIZE
+
+# Chunks kept loaded around the camera, in chunks in every direction.
+STREAM_RADIUS = 2
+# Extra chunks a loaded chunk may drift out of the radius before it is unloaded, so chunks on the
+# edge are not reloaded every time the camera moves back and forth.
+UNLOAD_MARGIN = 1
+
+
+# The ChunkStreamer class keeps only the chunks of a binary map near the camera in memory. Chunks
+# are decoded on a background thread and installed into the tilemap on the main thread; until a
+# chunk arrives, the tilemap treats its cells as empty.
+class ChunkStreamer:
+    def __init__(self, tilemap, path, radius=STREAM_RADIUS, margin=UNLOAD_MARGIN):
+        """
+        The function opens a binary map for streaming into `tilemap`, loading its tile types and
+        offgrid tiles and leaving the grid empty, and starts the loader thread.
+
+        :param tilemap: The `tilemap` parameter is the TileMap to stream into. Its grid becomes
+        read-only: edits to streamed chunks are lost when they are unloaded
+        :param path: The `path` parameter is the binary map file to stream
+        :param radius: The `radius` parameter is the number of chunks loaded around the camera in every
+        direction, defaults to STREAM_RADIUS (optional)
+        :param margin: The `margin` parameter is how many chunks beyond `radius` a loaded chunk may be
+        before it is unloaded, defaults to UNLOAD_MARGIN (optional)
+        """
+        self.tilemap = tilemap
+        self.map_file = tilemap.open_binary(path)
+        self.radius = radius
+        self.margin = margin
+        self.requested = set()
+        # (type id, variant) pairs taken out of the map by `extract`, cleared from every chunk on
+        # install.
+        self.extracted = set()
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.loaded = 0
+        self.unloaded = 0
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        """
+        The function runs on the loader thread, decoding requested chunks until it receives None.
+        """
+        while True:
+            key = self.requests.get()
+            if key is None:
+                return
+            self.results.put((key, self.map_file.chunk(key)))
+
+    def close(self):
+        """
+        The function stops the loader thread and unmaps the file. Loaded chunks stay in the tilemap.
+        """
+        if self.thread.is_alive():
+            self.requests.put(None)
+            self.thread.join()
+        self.map_file.close()
+
+    def chunk_at(self, pos) -> tuple:
+        """
+        The function returns the coordinate of the chunk containing a world position.
+
+        :param pos: The `pos` parameter is an (x, y) position in world pixels
+        :return: a (cx, cy) chunk coordinate.
+        """
+        chunk_px = CHUNK_SIZE * self.tilemap.tile_size
+        return (int(pos[0] // chunk_px), int(pos[1] // chunk_px))
+
+    def install(self, key, chunk_data):
+        """
+        The function adds a decoded chunk to the tilemap and drops the cached surfaces it draws into:
+        its own and those of the chunks its tiles overhang to the right and below.
+
+        :param key: The `key` parameter is the (cx, cy) chunk coordinate
+        :param chunk_data: The `chunk_data` parameter is the `(types, variants, count)` tuple returned
+        by `MapFile.chunk`
+        """
+        chunk = TileChunk(*chunk_data, solid_ids=self.tilemap.solid_ids)
+        if self.extracted:
+            self.strip(chunk)
+        self.tilemap.chunks[key] = chunk
+        self.tilemap.invalidate_chunk(key)
+        self.loaded += 1
+
+    def require(self, pos):
+        """
+        The function loads the chunks around a world position right away, on the calling thread, so
+        physics near the player never runs against chunks that are still on their way.
+
+        :param pos: The `pos` parameter is an (x, y) position in world pixels
+        """
+        cx, cy = self.chunk_at(pos)
+        for key in (
+            (x, y) for x in range(cx - 1, cx + 2) for y in range(cy - 1, cy + 2)
+        ):
+            if key in self.map_file.index and key not in self.tilemap.chunks:
+                self.install(key, self.map_file.chunk(key))
+
+    def update(self, center, focus=None):
+        """
+        The function installs the chunks the loader thread has finished, requests the missing chunks
+        within `radius` of `center` and unloads chunks that have drifted more than `radius + margin`
+        away. Their cached surfaces are dropped by `TileMap.draw_list`.
+
+        :param center: The `center` parameter is the world position the camera looks at
+        :param focus: The `focus` parameter is a world position whose neighbouring chunks must be loaded
+        before this call returns, typically the player's, defaults to None (optional)
+        """
+        chunks = self.tilemap.chunks
+        cx, cy = self.chunk_at(center)
+        keep = self.radius + self.margin
+
+        while True:
+            try:
+                key, chunk_data = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.requested.discard(key)
+            if key not in chunks and max(abs(key[0] - cx), abs(key[1] - cy)) <= keep:
+                self.install(key, chunk_data)
+
+        if focus is not None:
+            self.require(focus)
+
+        for key in [
+            key for key in chunks if max(abs(key[0] - cx), abs(key[1] - cy)) > keep
+        ]:
+            del chunks[key]
+            self.tilemap.invalidate_chunk(key)
+            self.unloaded += 1
+
+        index = self.map_file.index
+        for x in range(cx - self.radius, cx + self.radius + 1):
+            for y in range(cy - self.radius, cy + self.radius + 1):
+                key = (x, y)
+                if key in index and key not in chunks and key not in self.requested:
+                    self.requested.add(key)
+                    self.requests.put(key)
+
+    def strip(self, chunk):
+        """
+        The function clears the cells of a chunk that hold tiles taken out of the map by `extract`.
+
+        :param chunk: The `chunk` parameter is a TileChunk of the streamed map
+        """
+        types, variants = chunk.types, chunk.variants
+        for index in range(CHUNK_SIZE * CHUNK_SIZE):
+            if (types[index], variants[index]) in self.extracted:
+                chunk.clear(index)
+
+    def extract(self, id_pairs, keep=False) -> list:
+        """
+        The function finds every tile of the given types and variants in the whole map, loaded or not,
+        like `TileMap.extract`. Unless they are kept, the tiles are removed from the map: offgrid
+        tiles right away, and grid tiles from the loaded chunks and from every chunk installed later.
+
+        :param id_pairs: The `id_pairs` parameter is a list of `(type, variant)` tuples
+        :param keep: The `keep` parameter leaves the matched tiles in the map, defaults to False
+        (optional)
+        :return: a list of tile dictionaries, grid tile positions in pixels.
+        """
+        matches = []
+        for tile in self.tilemap.offgrid_of(id_pairs):
+            matches.append(tile.copy())
+            if not keep:
+                self.tilemap.remove_offgrid(tile)
+
+        id_pairs = set(id_pairs)
+        type_ids = {
+            self.tilemap.type_ids[tile_type]
+            for tile_type, _ in id_pairs
+            if tile_type in self.tilemap.type_ids
+        }
+        if not type_ids & self.map_file.grid_type_ids:
+            return matches
+        for tile in self.map_file.tiles(type_ids):
+            if (tile["type"], tile["variant"]) in id_pairs:
+                tile["pos"] = [
+                    tile["pos"][0] * self.tilemap.tile_size,
+                    tile["pos"][1] * self.tilemap.tile_size,
+                ]
+                matches.append(tile)
+
+        if not keep:
+            self.extracted.update(
+                (self.tilemap.type_ids[tile_type], variant)
+                for tile_type, variant in id_pairs
+                if tile_type in self.tilemap.type_ids
+            )
+            for key, chunk in self.tilemap.chunks.items():
+                self.strip(chunk)
+                self.tilemap.invalidate_chunk(key)
+        return matches
@@ -1,5 +1,9 @@
 import pygame
 import json
+import numpy as np
+from array import array
+from scripts.spatial import SpatialHash
+from scripts.mapfile import MapFile, MAP_EXTENSION, write_map
 
 NEIGHBOR_OFFSETS = [
     (-1, 0),
@@ -14,36 +18,462 @@ NEIGHBOR_OFFSETS = [
 ]
 PHYSICS_TILES = {"grass", "stone"}
 
+# Neighbour bits of an autotile mask: set when the neighbour in that direction has the same type.
+AUTOTILE_RIGHT = 1
+AUTOTILE_LEFT = 2
+AUTOTILE_UP = 4
+AUTOTILE_DOWN = 8
+AUTOTILE_SHIFTS = {
+    (1, 0): AUTOTILE_RIGHT,
+    (-1, 0): AUTOTILE_LEFT,
+    (0, -1): AUTOTILE_UP,
+    (0, 1): AUTOTILE_DOWN,
+}
+
 AUTOTILE_MAP = {
-    tuple(sorted([(1, 0), (0, 1)])): 0,
-    tuple(sorted([(1, 0), (0, 1), (-1, 0)])): 1,
-    tuple(sorted([(-1, 0), (0, 1)])): 2,
-    tuple(sorted([(-1, 0), (0, -1), (0, 1)])): 3,
-    tuple(sorted([(-1, 0), (0, -1)])): 4,
-    tuple(sorted([(-1, 0), (0, -1), (1, 0)])): 5,
-    tuple(sorted([(1, 0), (0, -1)])): 6,
-    tuple(sorted([(1, 0), (0, -1), (0, 1)])): 7,
-    tuple(sorted([(1, 0), (-1, 0), (0, 1), (0, -1)])): 8,
+    AUTOTILE_RIGHT | AUTOTILE_DOWN: 0,
+    AUTOTILE_RIGHT | AUTOTILE_DOWN | AUTOTILE_LEFT: 1,
+    AUTOTILE_LEFT | AUTOTILE_DOWN: 2,
+    AUTOTILE_LEFT | AUTOTILE_UP | AUTOTILE_DOWN: 3,
+    AUTOTILE_LEFT | AUTOTILE_UP: 4,
+    AUTOTILE_LEFT | AUTOTILE_UP | AUTOTILE_RIGHT: 5,
+    AUTOTILE_RIGHT | AUTOTILE_UP: 6,
+    AUTOTILE_RIGHT | AUTOTILE_UP | AUTOTILE_DOWN: 7,
+    AUTOTILE_RIGHT | AUTOTILE_LEFT | AUTOTILE_DOWN | AUTOTILE_UP: 8,
 }
+# Variant for every neighbour mask, or -1 where the variant is left alone.
+AUTOTILE_LUT = np.array(
+    [AUTOTILE_MAP.get(mask, -1) for mask in range(16)], dtype=np.int16
+)
 AUTOTILE_TYPES = {"grass", "stone"}
 
+CHUNK_SIZE = 16
+EMPTY = -1
+OFFGRID_CELL_SIZE = 128
+# Chunks whose cached surfaces are kept around the visible ones, in every direction. Surfaces further
+# from the view are dropped and rebuilt if the camera comes back.
+SURFACE_MARGIN = 2
+
+
+# The TileChunk class stores a fixed-size square of grid tiles as compact id arrays.
+class TileChunk:
+    def __init__(self, types=None, variants=None, count=0, solid_ids=()):
+        """
+        The function initializes a chunk with one type id and one variant id per cell, and a solidity
+        flag per cell for collision queries.
+
+        :param types: The `types` parameter is an int16 array of CHUNK_SIZE * CHUNK_SIZE type ids to
+        adopt, defaults to an empty chunk (optional)
+        :param variants: The `variants` parameter is the matching array of variants (optional)
+        :param count: The `count` parameter is the number of filled cells in `types`, defaults to 0
+        (optional)
+        :param solid_ids: The `solid_ids` parameter is the set of type ids that collide, used to fill
+        the solidity flags of `types`, defaults to () (optional)
+        """
+        if types is None:
+            types = array("h", [EMPTY]) * (CHUNK_SIZE * CHUNK_SIZE)
+            variants = array("h", [0]) * (CHUNK_SIZE * CHUNK_SIZE)
+        self.types = types
+        self.variants = variants
+        self.count = count
+        self.solid = bytearray(type_id in solid_ids for type_id in types)
+
+    def set(self, index, type_id, variant, solid=False):
+        """
+        The function stores a tile in the cell at `index`, keeping the number of filled cells up to date.
+
+        :param index: The `index` parameter is the flat index of the cell inside the chunk
+        :param type_id: The `type_id` parameter is the integer id of the tile type
+        :param variant: The `variant` parameter is the variant number of the tile
+        :param solid: The `solid` parameter tells whether the tile collides, defaults to False
+        (optional)
+        """
+        if self.types[index] == EMPTY:
+            self.count += 1
+        self.types[index] = type_id
+        self.variants[index] = variant
+        self.solid[index] = solid
+
+    def clear(self, index):
+        """
+        The function empties the cell at `index`.
+
+        :param index: The `index` parameter is the flat index of the cell inside the chunk
+        :return: True if a tile was removed, False if the cell was already empty.
+        """
+        if self.types[index] == EMPTY:
+            return False
+        self.types[index] = EMPTY
+        self.variants[index] = 0
+        self.solid[index] = False
+        self.count -= 1
+        return True
+
+
+# The LazyChunks class is the chunk dictionary of a map loaded from a binary map file. Chunks stay
+# encoded in the memory-mapped file until they are first looked up; iterating decodes them all.
+class LazyChunks(dict):
+    def __init__(self, map_file, solid_ids):
+        """
+        The function initializes an empty dictionary backed by `map_file`.
+
+        :param map_file: The `map_file` parameter is an open `scripts.mapfile.MapFile`, whose type ids
+        must match the tile map's. It is closed once every chunk has been decoded
+        :param solid_ids: The `solid_ids` parameter is the tile map's set of colliding type ids
+        """
+        super().__init__()
+        self.map_file = map_file
+        self.solid_ids = solid_ids
+        self.pending = set(map_file.index)
+
+    def decode(self, key):
+        """
+        The function decodes one pending chunk from the map file and stores it.
+
+        :param key: The `key` parameter is the (cx, cy) coordinate of a pending chunk
+        :return: the decoded TileChunk.
+        """
+        self.pending.discard(key)
+        chunk = TileChunk(*self.map_file.chunk(key), solid_ids=self.solid_ids)
+        dict.__setitem__(self, key, chunk)
+        if not self.pending:
+            self.map_file.close()
+        return chunk
+
+    def decode_all(self):
+        """
+        The function decodes every pending chunk.
+        """
+        for key in list(self.pending):
+            self.decode(key)
+
+    def __missing__(self, key):
+        if key in self.pending:
+            return self.decode(key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.pending
+
+    def __len__(self):
+        return dict.__len__(self) + len(self.pending)
+
+    def __setitem__(self, key, chunk):
+        self.pending.discard(key)
+        dict.__setitem__(self, key, chunk)
+
+    def __delitem__(self, key):
+        if key in self.pending:
+            self.pending.discard(key)
+        else:
+            dict.__delitem__(self, key)
+
+    def get(self, key, default=None):
+        chunk = dict.get(self, key)
+        if chunk is None:
+            if key not in self.pending:
+                return default
+            chunk = self.decode(key)
+        return chunk
+
+    def holding(self, type_ids):
+        """
+        The function returns the chunks that may hold tiles of the given types, decoding only the
+        pending chunks the map file's index lists as holding one of them.
+
+        :param type_ids: The `type_ids` parameter is a set of tile type ids
+        :return: a list of `((cx, cy), chunk)` pairs.
+        """
+        if type_ids & self.map_file.grid_type_ids:
+            for key in self.map_file.holding(type_ids):
+                if key in self.pending:
+                    self.decode(key)
+        return list(dict.items(self))
+
+    def __iter__(self):
+        self.decode_all()
+        return dict.__iter__(self)
+
+    def keys(self):
+        self.decode_all()
+        return dict.keys(self)
+
+    def values(self):
+        self.decode_all()
+        return dict.values(self)
+
+    def items(self):
+        self.decode_all()
+        return dict.items(self)
+
 
 # The TileMap class represents a map made up of tiles.
 class TileMap:
-    def __init__(self, game, tile_size=32):
+    def __init__(self, game, tile_size=32, preload=None):
         """
-        The function initializes a class instance with a game object, a tilemap dictionary, a list of
-        offgrid tiles, and a tile size.
+        The function initializes a class instance with a game object, a chunked grid of tiles, a spatial
+        index of offgrid tiles, and a tile size.
 
         :param game: The "game" parameter is a reference to the game object that this tilemap belongs
         to. It is used to access and modify the game state and to interact with other game objects
         :param tile_size: The `tile_size` parameter is the size of each tile in pixels. It determines
         the width and height of each tile on the game map, defaults to 32 (optional)
+        :param preload: The `preload` parameter is called with the tile types of a map being loaded,
+        once they are known and before its offgrid tiles look up their images, e.g.
+        `AssetRegistry.preload`, defaults to None (optional)
         """
         self.game = game
-        self.tilemap = {}
-        self.offgrid_tiles = []
+        self.preload = preload
+        self.chunks = {}
+        self.tile_types = []
+        self.type_ids = {}
+        self.solid_ids = set()
+        self.offgrid = SpatialHash(cell_size=OFFGRID_CELL_SIZE)
+        self.offgrid_groups = {}
         self.tile_size = tile_size
+        self.chunk_surfaces = {}
+        self.surface_range = None
+        self.autotile_on_edit = False
+        self.collision_rects = []
+
+    @property
+    def offgrid_tiles(self) -> list:
+        """
+        The function returns every offgrid tile, in the order they were added.
+        :return: a list of offgrid tile dictionaries.
+        """
+        return list(self.offgrid)
+
+    def type_id(self, tile_type) -> int:
+        """
+        The function returns the integer id used to store `tile_type` in the chunks, registering the
+        type the first time it is seen.
+
+        :param tile_type: The `tile_type` parameter is the name of the tile type, e.g. "grass"
+        :return: the integer id of the tile type.
+        """
+        if tile_type not in self.type_ids:
+            self.type_ids[tile_type] = len(self.tile_types)
+            self.tile_types.append(tile_type)
+            if tile_type in PHYSICS_TILES:
+                self.solid_ids.add(self.type_ids[tile_type])
+        return self.type_ids[tile_type]
+
+    def get_tile(self, x, y):
+        """
+        The function returns the grid tile at the tile coordinates `x`, `y`.
+
+        :param x: The `x` parameter is the horizontal tile coordinate
+        :param y: The `y` parameter is the vertical tile coordinate
+        :return: a tile dictionary with "type", "variant" and "pos" keys, or None if the cell is empty.
+        """
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return None
+        index = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+        type_id = chunk.types[index]
+        if type_id == EMPTY:
+            return None
+        return {
+            "type": self.tile_types[type_id],
+            "variant": chunk.variants[index],
+            "pos": [x, y],
+        }
+
+    def set_tile(self, x, y, tile_type, variant):
+        """
+        The function places a grid tile at the tile coordinates `x`, `y`, replacing any existing tile.
+
+        :param x: The `x` parameter is the horizontal tile coordinate
+        :param y: The `y` parameter is the vertical tile coordinate
+        :param tile_type: The `tile_type` parameter is the name of the tile type
+        :param variant: The `variant` parameter is the variant number of the tile
+        """
+        key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = TileChunk()
+        index = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+        type_id = self.type_id(tile_type)
+        if chunk.types[index] == type_id:
+            if chunk.variants[index] == variant:
+                return
+            # Autotiling would put the current variant straight back, e.g. while the editor paints
+            # over the same cell every frame, so nothing changes.
+            if (
+                self.autotile_on_edit
+                and self.autotile_variant(x, y, type_id) == chunk.variants[index]
+            ):
+                return
+        if chunk.types[index] != EMPTY:
+            self.invalidate_tile(
+                x, y, self.tile_types[chunk.types[index]], chunk.variants[index]
+            )
+        chunk.set(index, type_id, variant, type_id in self.solid_ids)
+        self.invalidate_tile(x, y, tile_type, variant)
+        if self.autotile_on_edit:
+            self.autotile_around(x, y)
+
+    def remove_tile(self, x, y):
+        """
+        The function removes the grid tile at the tile coordinates `x`, `y`, dropping its chunk once the
+        chunk is empty.
+
+        :param x: The `x` parameter is the horizontal tile coordinate
+        :param y: The `y` parameter is the vertical tile coordinate
+        :return: True if a tile was removed, False if the cell was already empty.
+        """
+        key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            return False
+        index = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+        if chunk.types[index] == EMPTY:
+            return False
+        self.invalidate_tile(
+            x, y, self.tile_types[chunk.types[index]], chunk.variants[index]
+        )
+        chunk.clear(index)
+        if not chunk.count:
+            del self.chunks[key]
+        if self.autotile_on_edit:
+            self.autotile_around(x, y)
+        return True
+
+    def add_offgrid(self, tile):
+        """
+        The function adds an offgrid tile to the map.
+
+        :param tile: The `tile` parameter is a dictionary with "type", "variant" and "pos" keys, where
+        "pos" is in pixels
+        """
+        rect = self.offgrid_rect(tile)
+        self.offgrid.insert(tile, rect)
+        self.offgrid_groups.setdefault((tile["type"], tile["variant"]), {})[
+            id(tile)
+        ] = tile
+        self.invalidate_rect(rect)
+
+    def remove_offgrid(self, tile):
+        """
+        The function removes an offgrid tile from the map.
+
+        :param tile: The `tile` parameter is one of the dictionaries stored in `offgrid_tiles`
+        """
+        rect = self.offgrid.rect(tile)
+        self.offgrid.remove(tile)
+        group = self.offgrid_groups[(tile["type"], tile["variant"])]
+        del group[id(tile)]
+        if not group:
+            del self.offgrid_groups[(tile["type"], tile["variant"])]
+        self.invalidate_rect(rect)
+
+    def offgrid_in(self, rect) -> list:
+        """
+        The function returns the offgrid tiles whose images overlap `rect`.
+
+        :param rect: The `rect` parameter is the query area in world pixels, e.g. the viewport
+        :return: a list of offgrid tile dictionaries, in the order they were added.
+        """
+        return self.offgrid.query_rect(rect)
+
+    def offgrid_at(self, pos) -> list:
+        """
+        The function returns the offgrid tiles whose images contain the point `pos`.
+
+        :param pos: The `pos` parameter is a point in world pixels
+        :return: a list of offgrid tile dictionaries, in the order they were added.
+        """
+        return self.offgrid.query_point(pos)
+
+    def offgrid_of(self, id_pairs) -> list:
+        """
+        The function returns the offgrid tiles matching any of the given type and variant pairs.
+
+        :param id_pairs: The `id_pairs` parameter is a list of `(type, variant)` tuples
+        :return: a list of offgrid tile dictionaries.
+        """
+        return [
+            tile
+            for pair in dict.fromkeys(id_pairs)
+            for tile in self.offgrid_groups.get(pair, {}).values()
+        ]
+
+    def offgrid_rect(self, tile):
+        """
+        The function returns the pixel bounds covered by an offgrid tile's image.
+
+        :param tile: The `tile` parameter is an offgrid tile dictionary
+        :return: a pygame.Rect in world pixels.
+        """
+        img = self.game.assets[tile["type"]][tile["variant"]]
+        return pygame.Rect(
+            int(tile["pos"][0]), int(tile["pos"][1]), img.get_width(), img.get_height()
+        )
+
+    def invalidate_tile(self, x, y, tile_type, variant):
+        """
+        The function drops the cached surfaces of every chunk covered by the image of a grid tile, so
+        the next `render` rebuilds them.
+
+        :param x: The `x` parameter is the horizontal tile coordinate
+        :param y: The `y` parameter is the vertical tile coordinate
+        :param tile_type: The `tile_type` parameter is the type of the tile that changed
+        :param variant: The `variant` parameter is the variant of the tile that changed
+        """
+        if self.chunk_surfaces:
+            img = self.game.assets[tile_type][variant]
+            self.invalidate_rect(
+                pygame.Rect(
+                    x * self.tile_size,
+                    y * self.tile_size,
+                    img.get_width(),
+                    img.get_height(),
+                )
+            )
+
+    def invalidate_chunk(self, key):
+        """
+        The function drops the cached surfaces that the grid tiles of chunk `key` are drawn into: its
+        own and those of the chunks its tiles can overhang, to the right and below.
+
+        :param key: The `key` parameter is the (cx, cy) chunk coordinate
+        """
+        cx, cy = key
+        for surface_key in ((cx, cy), (cx + 1, cy), (cx, cy + 1), (cx + 1, cy + 1)):
+            self.chunk_surfaces.pop(surface_key, None)
+
+    def invalidate_rect(self, rect):
+        """
+        The function drops the cached surfaces of every chunk overlapping `rect`.
+
+        :param rect: The `rect` parameter is a pygame.Rect in world pixels
+        """
+        if not self.chunk_surfaces:
+            return
+        chunk_px = CHUNK_SIZE * self.tile_size
+        for cx in range(rect.left // chunk_px, (rect.right - 1) // chunk_px + 1):
+            for cy in range(rect.top // chunk_px, (rect.bottom - 1) // chunk_px + 1):
+                self.chunk_surfaces.pop((cx, cy), None)
+
+    def tiles(self):
+        """
+        The function iterates over every grid tile in the map.
+
+        :return: a generator of tile dictionaries with "type", "variant" and "pos" keys.
+        """
+        for (cx, cy), chunk in self.chunks.items():
+            types = chunk.types
+            for index in range(CHUNK_SIZE * CHUNK_SIZE):
+                if types[index] != EMPTY:
+                    yield {
+                        "type": self.tile_types[types[index]],
+                        "variant": chunk.variants[index],
+                        "pos": [
+                            cx * CHUNK_SIZE + index % CHUNK_SIZE,
+                            cy * CHUNK_SIZE + index // CHUNK_SIZE,
+                        ],
+                    }
 
     def extract(self, id_pairs, keep=False):
         """
@@ -51,7 +481,7 @@ class TileMap:
         them from the tilemap.
 
         :param id_pairs: The `id_pairs` parameter is a list of tuples representing the tile type and
-        variant that you want to extract from the `offgrid_tiles` and `tilemap` lists. Each tuple in
+        variant that you want to extract from the `offgrid_tiles` and the grid. Each tuple in
         `id_pairs` should have the format `(type, variant)`, where `type` is the type
         :param keep: The `keep` parameter is a boolean flag that determines whether the matched tiles
         should be kept in their original positions or removed from the tilemap. If `keep` is set to
@@ -59,21 +489,48 @@ class TileMap:
         :return: a list of dictionaries that match the given id_pairs.
         """
         matches = []
-        for tile in self.offgrid_tiles.copy():
-            if (tile["type"], tile["variant"]) in id_pairs:
-                matches.append(tile.copy())
-                if not keep:
-                    self.offgrid_tiles.remove(tile)
-
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
-            if (tile["type"], tile["variant"]) in id_pairs:
-                matches.append(tile.copy())
-                matches[-1]["pos"] = matches[-1]["pos"].copy()
-                matches[-1]["pos"][0] *= self.tile_size
-                matches[-1]["pos"][1] *= self.tile_size
-                if not keep:
-                    del self.tilemap[loc]
+        for tile in self.offgrid_of(id_pairs):
+            matches.append(tile.copy())
+            if not keep:
+                self.remove_offgrid(tile)
+
+        id_pairs = {
+            (self.type_ids[tile_type], variant)
+            for tile_type, variant in id_pairs
+            if tile_type in self.type_ids
+        }
+        if not id_pairs:
+            return matches
+
+        if isinstance(self.chunks, LazyChunks):
+            chunks = self.chunks.holding({type_id for type_id, _ in id_pairs})
+        else:
+            chunks = list(self.chunks.items())
+        for (cx, cy), chunk in chunks:
+            types, variants = chunk.types, chunk.variants
+            for index in range(CHUNK_SIZE * CHUNK_SIZE):
+                if (types[index], variants[index]) in id_pairs:
+                    matches.append(
+                        {
+                            "type": self.tile_types[types[index]],
+                            "variant": variants[index],
+                            "pos": [
+                                (cx * CHUNK_SIZE + index % CHUNK_SIZE) * self.tile_size,
+                                (cy * CHUNK_SIZE + index // CHUNK_SIZE)
+                                * self.tile_size,
+                            ],
+                        }
+                    )
+                    if not keep:
+                        self.invalidate_tile(
+                            cx * CHUNK_SIZE + index % CHUNK_SIZE,
+                            cy * CHUNK_SIZE + index // CHUNK_SIZE,
+                            self.tile_types[types[index]],
+                            variants[index],
+                        )
+                        chunk.clear(index)
+            if not chunk.count:
+                del self.chunks[(cx, cy)]
 
         return matches
 
@@ -87,28 +544,34 @@ class TileMap:
         :return: a list of tiles.
         """
         tiles = []
-        tile_location = (int(pos[0] // self.tile_size), int(pos[1] // self.tile_size))
+        tile_x, tile_y = int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
         for offset in NEIGHBOR_OFFSETS:
-            check_location = (
-                f"{tile_location[0] + offset[0]};{tile_location[1] + offset[1]}"
-            )
-            if check_location in self.tilemap:
-                tiles.append(self.tilemap[check_location])
+            tile = self.get_tile(tile_x + offset[0], tile_y + offset[1])
+            if tile is not None:
+                tiles.append(tile)
         return tiles
 
     def save(self, path):
         """
         The function saves the tilemap, tile size, and offgrid tiles to a JSON file at the specified
-        path.
+        path, or to a binary map file if the path ends in MAP_EXTENSION.
 
         :param path: The `path` parameter is the file path where you want to save the data. It should be
         a string representing the file path, including the file name and extension. For example,
         "data.json" or "C:/Users/username/data.json"
         """
+        if path.endswith(MAP_EXTENSION):
+            write_map(
+                path, self.tile_size, CHUNK_SIZE, self.tiles(), self.offgrid_tiles
+            )
+            return
         with open(path, "w") as f:
             json.dump(
                 {
-                    "tilemap": self.tilemap,
+                    "tilemap": {
+                        f"{tile['pos'][0]};{tile['pos'][1]}": tile
+                        for tile in self.tiles()
+                    },
                     "tile_size": self.tile_size,
                     "offgrid": self.offgrid_tiles,
                 },
@@ -116,11 +579,111 @@ class TileMap:
             )
 
     def load(self, path):
+        """
+        The function loads a map saved by `save`, rebuilding the chunked grid from its tile list.
+        Binary maps, whose path ends in MAP_EXTENSION, are memory-mapped instead and their chunks are
+        decoded on first use.
+
+        :param path: The `path` parameter is the file path of the JSON or binary map to load
+        """
+        if path.endswith(MAP_EXTENSION):
+            self.load_binary(path)
+            return
         with open(path, "r") as f:
             map_data = json.load(f)
-            self.tilemap = map_data["tilemap"]
-            self.tile_size = map_data["tile_size"]
-            self.offgrid_tiles = map_data["offgrid"]
+        self.tile_types = []
+        self.type_ids = {}
+        self.solid_ids = set()
+        self.clear_chunks()
+        self.chunk_surfaces = {}
+        # Cells are written straight into their chunks rather than through `set_tile`, so the saved
+        # variants are kept even when `autotile_on_edit` is set.
+        for tile in map_data["tilemap"].values():
+            x, y = tile["pos"]
+            key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                chunk = self.chunks[key] = TileChunk()
+            type_id = self.type_id(tile["type"])
+            chunk.set(
+                (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE,
+                type_id,
+                tile["variant"],
+                type_id in self.solid_ids,
+            )
+        self.tile_size = map_data["tile_size"]
+        self.offgrid = SpatialHash(cell_size=OFFGRID_CELL_SIZE)
+        self.offgrid_groups = {}
+        if self.preload is not None:
+            self.preload(
+                self.tile_types + [tile["type"] for tile in map_data["offgrid"]]
+            )
+        for tile in map_data["offgrid"]:
+            self.add_offgrid(tile)
+
+    def clear_chunks(self):
+        """
+        The function empties the grid. If the chunks were still being decoded from a binary map, its
+        file is unmapped.
+        """
+        if isinstance(self.chunks, LazyChunks):
+            self.chunks.map_file.close()
+        self.chunks = {}
+
+    def load_binary(self, path):
+        """
+        The function loads a binary map written by `save` or `scripts/mapfile.py`.
+
+        :param path: The `path` parameter is the file path of the binary map to load
+        """
+        map_file = self.open_binary(path)
+        if map_file.index:
+            self.chunks = LazyChunks(map_file, self.solid_ids)
+        else:
+            map_file.close()
+
+    def open_binary(self, path):
+        """
+        The function opens a binary map and resets the tilemap to it: its tile types, tile size and
+        offgrid tiles are loaded and the grid is left empty, for the caller to fill from the file.
+
+        :param path: The `path` parameter is the file path of the binary map to open
+        :return: the open `scripts.mapfile.MapFile`.
+        """
+        map_file = MapFile(path)
+        if map_file.chunk_size != CHUNK_SIZE:
+            map_file.close()
+            raise ValueError(
+                f"{path} uses {map_file.chunk_size}-tile chunks, expected {CHUNK_SIZE}"
+            )
+        self.tile_types = []
+        self.type_ids = {}
+        self.solid_ids = set()
+        for tile_type in map_file.tile_types:
+            self.type_id(tile_type)
+        self.tile_size = map_file.tile_size
+        self.clear_chunks()
+        self.chunk_surfaces = {}
+        self.offgrid = SpatialHash(cell_size=OFFGRID_CELL_SIZE)
+        self.offgrid_groups = {}
+        if self.preload is not None:
+            self.preload(map_file.tile_types)
+        for tile in map_file.offgrid:
+            self.add_offgrid(tile)
+        return map_file
+
+    def solid_at(self, pos) -> bool:
+        """
+        The function tells whether the point `pos` lies inside a solid grid tile.
+
+        :param pos: The `pos` parameter is an (x, y) point in world pixels
+        :return: True if the tile under the point collides.
+        """
+        x, y = int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        return chunk is not None and bool(
+            chunk.solid[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]
+        )
 
     def physics_rects_around(self, pos) -> list:
         """
@@ -130,72 +693,269 @@ class TileMap:
         :param pos: The `pos` parameter represents the position of a tile on a grid
         :return: a list of pygame.Rect objects.
         """
-        return [
-            pygame.Rect(
-                tile["pos"][0] * self.tile_size,
-                tile["pos"][1] * self.tile_size,
-                self.tile_size,
-                self.tile_size,
-            )
-            for tile in self.tiles_around(pos)
-            if tile["type"] in PHYSICS_TILES
-        ]
+        rects = []
+        tile_x, tile_y = int(pos[0] // self.tile_size), int(pos[1] // self.tile_size)
+        for offset in NEIGHBOR_OFFSETS:
+            x, y = tile_x + offset[0], tile_y + offset[1]
+            chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+            if (
+                chunk is not None
+                and chunk.solid[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]
+            ):
+                rects.append(
+                    pygame.Rect(
+                        x * self.tile_size,
+                        y * self.tile_size,
+                        self.tile_size,
+                        self.tile_size,
+                    )
+                )
+        return rects
+
+    def solid_rects(self, rect, movement=(0, 0)) -> list:
+        """
+        The function returns the solid grid tiles overlapping the area an entity swept through in its
+        last move: `rect`, its current bounds, joined with where it was before moving by `movement`.
+        It reads the chunks' solidity flags and hands out rects from a pool that is reused by the next
+        call, so the result must be consumed before querying again.
+
+        :param rect: The `rect` parameter is the entity's pygame.Rect after the move, in world pixels
+        :param movement: The `movement` parameter is the (x, y) distance the entity just moved, defaults
+        to (0, 0) (optional)
+        :return: a list of pygame.Rect objects, one per solid tile, in row-major order.
+        """
+        tile_size = self.tile_size
+        left, right, top, bottom = rect.left, rect.right, rect.top, rect.bottom
+        if movement[0] > 0:
+            left -= movement[0]
+        else:
+            right -= movement[0]
+        if movement[1] > 0:
+            top -= movement[1]
+        else:
+            bottom -= movement[1]
+        x_range = range(int(left // tile_size), int((right - 1) // tile_size) + 1)
+        chunks = self.chunks
+        pool = self.collision_rects
+        count = 0
+        for y in range(int(top // tile_size), int((bottom - 1) // tile_size) + 1):
+            cy, row = divmod(y, CHUNK_SIZE)
+            row *= CHUNK_SIZE
+            for x in x_range:
+                cx, column = divmod(x, CHUNK_SIZE)
+                chunk = chunks.get((cx, cy))
+                if chunk is not None and chunk.solid[row + column]:
+                    if count == len(pool):
+                        pool.append(pygame.Rect(0, 0, tile_size, tile_size))
+                    pool[count].update(
+                        x * tile_size, y * tile_size, tile_size, tile_size
+                    )
+                    count += 1
+        return pool[:count]
+
+    def type_at(self, x, y) -> int:
+        """
+        The function returns the type id of the grid tile at the tile coordinates `x`, `y`.
+
+        :param x: The `x` parameter is the horizontal tile coordinate
+        :param y: The `y` parameter is the vertical tile coordinate
+        :return: the type id, or EMPTY if the cell is empty.
+        """
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return EMPTY
+        return chunk.types[(y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE]
+
+    def autotile_tile(self, x, y):
+        """
+        The function picks the variant of the grid tile at `x`, `y` from the tiles of the same type
+        next to it, if its type is autotiled.
+
+        :param x: The `x` parameter is the horizontal tile coordinate
+        :param y: The `y` parameter is the vertical tile coordinate
+        """
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return
+        index = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+        type_id = chunk.types[index]
+        if type_id == EMPTY:
+            return
+        variant = self.autotile_variant(x, y, type_id)
+        if variant >= 0 and chunk.variants[index] != variant:
+            self.invalidate_tile(x, y, self.tile_types[type_id], chunk.variants[index])
+            chunk.variants[index] = variant
+            self.invalidate_tile(x, y, self.tile_types[type_id], variant)
+
+    def autotile_variant(self, x, y, type_id) -> int:
+        """
+        The function returns the variant autotiling picks for a tile of type `type_id` at `x`, `y`.
+
+        :param x: The `x` parameter is the horizontal tile coordinate
+        :param y: The `y` parameter is the vertical tile coordinate
+        :param type_id: The `type_id` parameter is the integer id of the tile type
+        :return: the variant from AUTOTILE_LUT, or -1 if the type is not autotiled or its neighbours
+        match no variant.
+        """
+        if self.tile_types[type_id] not in AUTOTILE_TYPES:
+            return -1
+        mask = 0
+        for (dx, dy), bit in AUTOTILE_SHIFTS.items():
+            if self.type_at(x + dx, y + dy) == type_id:
+                mask |= bit
+        return int(AUTOTILE_LUT[mask])
+
+    def autotile_around(self, x, y):
+        """
+        The function re-resolves the autotiled variants affected by a change at `x`, `y`: the tile itself
+        and its four neighbours.
+
+        :param x: The `x` parameter is the horizontal tile coordinate of the changed cell
+        :param y: The `y` parameter is the vertical tile coordinate of the changed cell
+        """
+        self.autotile_tile(x, y)
+        for dx, dy in AUTOTILE_SHIFTS:
+            self.autotile_tile(x + dx, y + dy)
 
     def autotile(self):
-        for loc in self.tilemap:
-            tile = self.tilemap[loc]
-            neighbors = set()
-            for shift in [
-                (1, 0),
-                (-1, 0),
-                (0, -1),
-                (0, 1),
-            ]:
-                check_loc = f"{tile['pos'][0] + shift[0]};{tile['pos'][1] + shift[1]}"
+        """
+        The function picks the variant of every autotiled grid tile in one vectorized pass: the chunks
+        are copied into one padded grid of type ids, each tile's neighbour mask is built from four
+        shifted comparisons and mapped through AUTOTILE_LUT.
+        """
+        autotile_ids = [
+            self.type_ids[tile_type]
+            for tile_type in AUTOTILE_TYPES
+            if tile_type in self.type_ids
+        ]
+        if not self.chunks or not autotile_ids:
+            return
+
+        keys = list(self.chunks)
+        min_cx = min(cx for cx, _ in keys)
+        min_cy = min(cy for _, cy in keys)
+        width = (max(cx for cx, _ in keys) - min_cx + 1) * CHUNK_SIZE
+        height = (max(cy for _, cy in keys) - min_cy + 1) * CHUNK_SIZE
+        types = np.full((height + 2, width + 2), EMPTY, dtype=np.int16)
+        views = {}
+        for key in keys:
+            chunk = self.chunks[key]
+            x = (key[0] - min_cx) * CHUNK_SIZE + 1
+            y = (key[1] - min_cy) * CHUNK_SIZE + 1
+            types[y : y + CHUNK_SIZE, x : x + CHUNK_SIZE] = np.frombuffer(
+                chunk.types, dtype=np.int16
+            ).reshape(CHUNK_SIZE, CHUNK_SIZE)
+            views[key] = (x - 1, y - 1, chunk)
+
+        center = types[1:-1, 1:-1]
+        mask = (
+            (types[1:-1, 2:] == center) * AUTOTILE_RIGHT
+            | (types[1:-1, :-2] == center) * AUTOTILE_LEFT
+            | (types[:-2, 1:-1] == center) * AUTOTILE_UP
+            | (types[2:, 1:-1] == center) * AUTOTILE_DOWN
+        )
+        resolved = AUTOTILE_LUT[mask]
+        resolved[~np.isin(center, autotile_ids)] = -1
+
+        for key, (x, y, chunk) in views.items():
+            block = resolved[y : y + CHUNK_SIZE, x : x + CHUNK_SIZE].reshape(-1)
+            variants = np.frombuffer(chunk.variants, dtype=np.int16)
+            changed = (block >= 0) & (block != variants)
+            if changed.any():
+                variants[changed] = block[changed]
+                self.invalidate_chunk(key)
 
-                if (
-                    check_loc in self.tilemap
-                    and self.tilemap[check_loc]["type"] == tile["type"]
-                ):
-                    neighbors.add(shift)
+    def build_chunk_surface(self, cx, cy):
+        """
+        The function pre-renders the static tiles overlapping chunk `cx`, `cy` into one surface: the
+        offgrid tiles first, then the grid tiles, including the parts of neighbouring grid tiles whose
+        images hang over into this chunk.
+
+        :param cx: The `cx` parameter is the horizontal chunk coordinate
+        :param cy: The `cy` parameter is the vertical chunk coordinate
+        :return: a pygame.Surface covering the chunk, or None if nothing is drawn in it.
+        """
+        chunk_px = CHUNK_SIZE * self.tile_size
+        origin = (cx * chunk_px, cy * chunk_px)
+        bounds = pygame.Rect(origin, (chunk_px, chunk_px))
+        blits = []
+
+        for tile in self.offgrid_in(bounds):
+            tile_rect = self.offgrid.rect(tile)
+            blits.append(
+                (
+                    self.game.assets[tile["type"]][tile["variant"]],
+                    (tile_rect.x - origin[0], tile_rect.y - origin[1]),
+                )
+            )
+
+        for x in range((cx - 1) * CHUNK_SIZE, (cx + 1) * CHUNK_SIZE):
+            for y in range((cy - 1) * CHUNK_SIZE, (cy + 1) * CHUNK_SIZE):
+                chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+                if chunk is None:
+                    continue
+                index = (y % CHUNK_SIZE) * CHUNK_SIZE + x % CHUNK_SIZE
+                type_id = chunk.types[index]
+                if type_id == EMPTY:
+                    continue
+                img = self.game.assets[self.tile_types[type_id]][chunk.variants[index]]
+                pos = (x * self.tile_size - origin[0], y * self.tile_size - origin[1])
+                if pos[0] + img.get_width() > 0 and pos[1] + img.get_height() > 0:
+                    blits.append((img, pos))
 
-            neighbors = tuple(sorted(neighbors))
-            if (tile["type"] in AUTOTILE_TYPES) and (neighbors in AUTOTILE_MAP):
-                tile["variant"] = AUTOTILE_MAP[neighbors]
+        if not blits:
+            return None
+        surf = pygame.Surface((chunk_px, chunk_px), pygame.SRCALPHA)
+        surf.blits(blits, doreturn=False)
+        return surf
 
     def render(self, surf, offset=(0, 0)):
         """
-        The `render` function takes a surface and an offset, and blits the appropriate tiles onto the
-        surface based on the tilemap and offgrid_tiles.
+        The `render` function takes a surface and an offset, and blits the pre-rendered surfaces of the
+        visible chunks onto it, building any chunk whose cached surface is missing or was invalidated.
 
         :param surf: The "surf" parameter is the surface object on which the tiles will be rendered. It
         is the surface where the tiles will be drawn onto
         :param offset: The `offset` parameter is a tuple that represents the x and y coordinates of the
         top-left corner of the portion of the surface (`surf`) that should be rendered. It is used to
-        determine which tiles should be rendered based on their position relative to the offset
+        determine which chunks should be rendered based on their position relative to the offset
         """
-        for tile in self.offgrid_tiles:
-            surf.blit(
-                self.game.assets[tile["type"]][tile["variant"]],
-                (tile["pos"][0] - offset[0], tile["pos"][1] - offset[1]),
-            )
+        surf.blits(self.draw_list(surf.get_size(), offset=offset), doreturn=False)
 
-        for x in range(
-            offset[0] // self.tile_size,
-            (offset[0] + surf.get_width()) // self.tile_size + 1,
-        ):
-            for y in range(
-                offset[1] // self.tile_size,
-                (offset[1] + surf.get_height()) // self.tile_size + 1,
-            ):
-                loc = f"{x};{y}"
-                if loc in self.tilemap:
-                    tile = self.tilemap[loc]
+    def draw_list(self, size, offset=(0, 0)) -> list:
+        """
+        The function returns the chunk surfaces visible in a view of the given size, building any chunk
+        whose cached surface is missing or was invalidated. Whenever the view enters new chunks, the
+        cached surfaces more than SURFACE_MARGIN chunks outside it are dropped.
 
-                    surf.blit(
-                        self.game.assets[tile["type"]][tile["variant"]],
+        :param size: The `size` parameter is the (width, height) of the surface the map is drawn on
+        :param offset: The `offset` parameter is the camera scroll, defaults to (0, 0) (optional)
+        :return: a list of `(img, pos)` pairs.
+        """
+        chunk_px = CHUNK_SIZE * self.tile_size
+        left, top = offset[0] // chunk_px, offset[1] // chunk_px
+        right = (offset[0] + size[0]) // chunk_px
+        bottom = (offset[1] + size[1]) // chunk_px
+        if self.surface_range != (left, top, right, bottom):
+            self.surface_range = (left, top, right, bottom)
+            for key in [
+                (cx, cy)
+                for cx, cy in self.chunk_surfaces
+                if not left - SURFACE_MARGIN <= cx <= right + SURFACE_MARGIN
+                or not top - SURFACE_MARGIN <= cy <= bottom + SURFACE_MARGIN
+            ]:
+                del self.chunk_surfaces[key]
+        items = []
+        for cx in range(left, right + 1):
+            for cy in range(top, bottom + 1):
+                if (cx, cy) not in self.chunk_surfaces:
+                    self.chunk_surfaces[(cx, cy)] = self.build_chunk_surface(cx, cy)
+                chunk_surf = self.chunk_surfaces[(cx, cy)]
+                if chunk_surf is not None:
+                    items.append(
                         (
-                            tile["pos"][0] * self.tile_size - offset[0],
-                            tile["pos"][1] * self.tile_size - offset[1],
-                        ),
+                            chunk_surf,
+                            (cx * chunk_px - offset[0], cy * chunk_px - offset[1]),
+                        )
                     )
+        return items
@@ -1,10 +1,17 @@
 import os
+import functools
 import pygame
 
 # from screeninfo import get_monitors
 
 
 BASE_IMG_PATH = "data/images/"
+FLIP_CACHE_SIZE = 512
+
+# Packed texture atlas that image loads are served from, see `use_atlas`.
+atlas = None
+# Background decoder that images missing from the atlas are read through, see `use_loader`.
+loader = None
 
 
 # def get_monitor_size():
@@ -12,6 +19,46 @@ BASE_IMG_PATH = "data/images/"
 #         print(monitor)
 
 
+def use_atlas(new_atlas):
+    """
+    The function makes the image loaders below serve images from a packed texture atlas when it holds
+    them, instead of reading one file per image. Images missing from the atlas are still read from
+    disk.
+
+    :param new_atlas: The `new_atlas` parameter is a `scripts.atlas.Atlas`, or None to go back to
+    reading every image from disk
+    """
+    global atlas
+    atlas = new_atlas
+
+
+def use_loader(new_loader):
+    """
+    The function makes the image loaders below take images missing from the atlas from a background
+    decoder, so only the conversion for the display runs on the calling thread.
+
+    :param new_loader: The `new_loader` parameter is a `scripts.assets.AssetLoader`, or None to go back
+    to decoding every image on the calling thread
+    """
+    global loader
+    loader = new_loader
+
+
+def list_images(path) -> list:
+    """
+    The function `list_images` returns the sorted file names of the images in a directory, taken from
+    the atlas index when the atlas holds the directory.
+
+    :param path: The `path` parameter is a directory relative to BASE_IMG_PATH
+    :return: a sorted list of file names.
+    """
+    if atlas is not None and atlas.listdir(path) is not None:
+        return atlas.listdir(path)
+    if loader is not None and loader.listdir(path) is not None:
+        return loader.listdir(path)
+    return sorted(os.listdir(BASE_IMG_PATH + path))
+
+
 def load_image(path) -> str:
     """
     The function `load_image` loads an image from a given path and sets the color key to (0, 0, 0).
@@ -21,7 +68,12 @@ def load_image(path) -> str:
     :return: an image object.
     """
     # print("\n\n\n", BASE_IMG_PATH + path + "\n\n\n")
-    img = pygame.image.load(BASE_IMG_PATH + path).convert()
+    if atlas is not None and path in atlas:
+        return atlas.image(path)
+    if loader is not None:
+        img = loader.surface(path).convert()
+    else:
+        img = pygame.image.load(BASE_IMG_PATH + path).convert()
     img.set_colorkey((0, 0, 0))
     return img
 
@@ -34,10 +86,7 @@ def load_images(path) -> list:
     are located
     :return: The function `load_images` returns a list of loaded images.
     """
-    return [
-        load_image(f"{path}/{img_name}")
-        for img_name in sorted(os.listdir(BASE_IMG_PATH + path))
-    ]
+    return [load_image(f"{path}/{img_name}") for img_name in list_images(path)]
 
 
 def load_transparent_image(path) -> str:
@@ -49,6 +98,10 @@ def load_transparent_image(path) -> str:
     want to load
     :return: an image object.
     """
+    if atlas is not None and path in atlas:
+        return atlas.image(path, transparent=True)
+    if loader is not None:
+        return loader.surface(path).convert_alpha()
     return pygame.image.load(BASE_IMG_PATH + path).convert_alpha()
 
 
@@ -61,21 +114,37 @@ def load_transparent_images(path) -> list:
     :return: a list of transparent images that are loaded from the specified path.
     """
     return [
-        load_transparent_image(f"{path}/{img_name}")
-        for img_name in sorted(os.listdir(BASE_IMG_PATH + path))
+        load_transparent_image(f"{path}/{img_name}") for img_name in list_images(path)
     ]
 
 
-# The Animation class is a blueprint for creating animated objects in Python.
+@functools.lru_cache(maxsize=FLIP_CACHE_SIZE)
+def flip_image(img, flip_x=True, flip_y=False):
+    """
+    The function `flip_image` returns a mirrored copy of an image. Results are cached, so flipping the
+    same frame again only costs a lookup; the least recently used copies are dropped once
+    FLIP_CACHE_SIZE flipped frames are held.
+
+    :param img: The `img` parameter is the pygame.Surface to mirror. It must not be modified afterwards,
+    since cached copies are not refreshed
+    :param flip_x: The `flip_x` parameter mirrors the image horizontally, defaults to True (optional)
+    :param flip_y: The `flip_y` parameter mirrors the image vertically, defaults to False (optional)
+    :return: the flipped image.
+    """
+    return pygame.transform.flip(img, flip_x, flip_y)
+
+
+# The Animation class is the shared, read-only definition of an animation: its frames, how long each
+# is shown and whether it loops. Entities play it through their own AnimationCursor.
 class Animation:
     def __init__(self, images, image_duration=5, loop=True):
         """
-        The function initializes an object with a list of images, an image duration, a loop flag, a done
-        flag, and a frame counter.
+        The function initializes an animation and precomputes the image shown on every tick, so cursors
+        only keep a frame counter.
 
         :param images: The `images` parameter is a list of images that will be displayed or processed in
         some way. Each element in the list represents an image
-        :param image_duration: The `image_duration` parameter is the duration (in seconds) for which
+        :param image_duration: The `image_duration` parameter is the duration (in ticks) for which
         each image should be displayed, defaults to 5 (optional)
         :param loop: The "loop" parameter determines whether the animation should loop or not. If set to
         True, the animation will continue to play in a loop. If set to False, the animation will play
@@ -84,32 +153,49 @@ class Animation:
         self.images = images
         self.image_duration = image_duration
         self.loop = loop
-        self.done = False
-        self.frame = 0
+        self.length = image_duration * len(images)
+        self.last = self.length - 1
+        self.frame_images = tuple(img for img in images for _ in range(image_duration))
 
-    def copy(self):
+    def cursor(self):
         """
-        The function `copy` returns a new instance of the `Animation` class with the same images, image
-        duration, and loop value.
-        :return: The method is returning an instance of the Animation class.
+        The function starts playing the animation from its first frame.
+        :return: a new AnimationCursor.
         """
-        return Animation(self.images, self.image_duration, self.loop)
+        return AnimationCursor(self)
+
+
+# The AnimationCursor class is the position of one entity in a shared Animation.
+class AnimationCursor:
+    __slots__ = ("animation", "frame", "done")
+
+    def __init__(self, animation):
+        """
+        The function initializes a cursor on the first frame of an animation.
+
+        :param animation: The `animation` parameter is the Animation to play
+        """
+        self.animation = animation
+        self.frame = 0
+        self.done = False
 
     def update(self):
         """
-        The function updates the frame of an animation, taking into account whether the animation should
-        loop or not.
+        The function advances the cursor by one tick, wrapping around looping animations and stopping
+        on the last frame of the others.
         """
-        if self.loop:
-            self.frame = (self.frame + 1) % (self.image_duration * len(self.images))
+        animation = self.animation
+        if animation.loop:
+            self.frame = (self.frame + 1) % animation.length
+        elif self.frame < animation.last:
+            self.frame += 1
+            self.done = self.frame >= animation.last
         else:
-            self.frame = min(self.frame + 1, self.image_duration * len(self.images) - 1)
-            if self.frame >= self.image_duration * len(self.images) - 1:
-                self.done = True
+            self.done = True
 
     def img(self):
         """
-        The function returns an image based on the current frame and image duration.
-        :return: an image from a list of images based on the current frame and image duration.
+        The function returns the image shown on the cursor's current frame.
+        :return: an image from the animation's frame table.
         """
-        return self.images[int(self.frame / self.image_duration)]
+        return self.animation.frame_images[self.frame]